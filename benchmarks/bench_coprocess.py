@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Copyright (c) 2013-2014, Matthew Brennan Jones <matthew.brennan.jones@gmail.com>
+# Py-findlib is for finding libraries and programs on most operating systems
+# It uses a MIT style license
+# It is hosted at: https://github.com/workhorsy/py-findlib
+
+# Times run_and_get_stdout when this process forks for each command, and
+# when helper processes run them. Memory is used first, like in a large
+# build process, since that makes forking slower.
+
+import os, sys
+import argparse
+
+import subprocess
+
+import benchmark
+from benchmark import findlib, percentile, _timer
+
+def use_memory(megabytes):
+	# Touch every page, so they are really mapped
+	blocks = []
+	for i in range(megabytes):
+		block = bytearray(1024 * 1024)
+		for j in range(0, len(block), 4096):
+			block[j] = 1
+		blocks.append(block)
+	return blocks
+
+def time_commands(command, count):
+	latencies = []
+	for i in range(count):
+		start = _timer()
+		findlib.run_and_get_stdout(command)
+		latencies.append(_timer() - start)
+	return latencies
+
+def main():
+	parser = argparse.ArgumentParser(description='Benchmark running commands with and without helper processes.')
+	parser.add_argument('--commands', type=int, default=200, help='Commands to run for each mode')
+	parser.add_argument('--memory', type=int, default=500, help='Megabytes of memory to use first')
+	parser.add_argument('--coprocesses', type=int, default=2, help='Helper processes in the pooled mode')
+	args = parser.parse_args()
+
+	memory = use_memory(args.memory)
+	command = 'echo findlib'
+
+	print('{0} commands with {1} MB of memory used'.format(args.commands, args.memory))
+	print('    {0:<16} {1:>10} {2:>9} {3:>9} {4:>9}'.format('mode', 'cmd/s', 'p50 ms', 'p90 ms', 'p99 ms'))
+	# Python 3.10 and newer use vfork on Linux, which does not copy the
+	# memory. Other platforms and older Pythons do a full fork.
+	modes = [('vfork', 0, True), ('fork', 0, False), ('coprocesses', args.coprocesses, True)]
+	if not hasattr(subprocess, '_USE_VFORK'):
+		modes = [('fork', 0, True), ('coprocesses', args.coprocesses, True)]
+
+	for name, coprocesses, use_vfork in modes:
+		findlib.set_coprocesses(coprocesses)
+		if hasattr(subprocess, '_USE_VFORK'):
+			subprocess._USE_VFORK = use_vfork
+		try:
+			# Start the helpers before timing
+			findlib.run_and_get_stdout(command)
+			latencies = time_commands(command, args.commands)
+		finally:
+			findlib.set_coprocesses(0)
+			if hasattr(subprocess, '_USE_VFORK'):
+				subprocess._USE_VFORK = True
+
+		total = sum(latencies)
+		print('    {0:<16} {1:>10.1f} {2:>9.2f} {3:>9.2f} {4:>9.2f}'.format(
+			name, len(latencies) / total,
+			percentile(latencies, 50) * 1000,
+			percentile(latencies, 90) * 1000,
+			percentile(latencies, 99) * 1000))
+
+	del memory
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
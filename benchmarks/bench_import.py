@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Copyright (c) 2013-2014, Matthew Brennan Jones <matthew.brennan.jones@gmail.com>
+# Py-findlib is for finding libraries and programs on most operating systems
+# It uses a MIT style license
+# It is hosted at: https://github.com/workhorsy/py-findlib
+
+# Times "import findlib" in new processes with -X importtime, and fails if it
+# takes longer than the budget, or if it imports a module that should only be
+# imported when it is used.
+
+import os, sys
+import argparse
+import compileall
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+FINDLIB_DIR = os.path.join(os.path.dirname(BENCH_DIR), 'findlib')
+
+# Modules that importing findlib should not import
+LAZY_MODULES = [
+	'ast', 'platform', 'subprocess', 'socket', 'logging', 'tempfile',
+	'concurrent.futures', 'findlib_server', 'findlib_elf', 'findlib_coprocess',
+	'findlib_backends',
+]
+
+def time_import(statement):
+	'''
+	Imports in a new process. Returns the microseconds of each module and
+	the modules imported, in the order -X importtime printed them.
+	'''
+	process = subprocess.Popen(
+		[sys.executable, '-X', 'importtime', '-c', statement],
+		stdout = subprocess.PIPE,
+		stderr = subprocess.PIPE,
+		cwd = FINDLIB_DIR
+	)
+	stdout, stderr = process.communicate()
+	if process.returncode:
+		raise Exception('Import failed: {0}'.format(stderr.decode('UTF-8')))
+
+	modules = []
+	for line in stderr.decode('UTF-8').splitlines():
+		if not line.startswith('import time:') or 'cumulative' in line:
+			continue
+		self_us, cumulative_us, name = line[len('import time:') : ].split('|')
+		modules.append((name.strip(), int(self_us), int(cumulative_us)))
+	return modules
+
+def main():
+	parser = argparse.ArgumentParser(description='Benchmark the time to import findlib.')
+	parser.add_argument('--runs', type=int, default=20, help='Imports to time')
+	parser.add_argument('--budget', type=float, default=25.0, help='Most milliseconds the median import may take')
+	parser.add_argument('--top', type=int, default=10, help='Slowest modules to print')
+	args = parser.parse_args()
+
+	# Compile the .pyc files first, so the source is not compiled in each run
+	compileall.compile_dir(FINDLIB_DIR, quiet=1)
+
+	times = []
+	modules = None
+	for i in range(args.runs):
+		modules = time_import('import findlib')
+		times.append(dict([(name, cumulative) for name, self_us, cumulative in modules])['findlib'])
+	times.sort()
+	median = times[len(times) // 2] / 1000.0
+
+	print('import findlib: median {0:.2f}ms, best {1:.2f}ms of {2} runs (budget {3:.2f}ms)'.format(
+		median, times[0] / 1000.0, args.runs, args.budget))
+	print('    {0:<32} {1:>10} {2:>10}'.format('slowest modules', 'self ms', 'total ms'))
+	for name, self_us, cumulative_us in sorted(modules, key=lambda m: -m[1])[0 : args.top]:
+		print('    {0:<32} {1:>10.2f} {2:>10.2f}'.format(name, self_us / 1000.0, cumulative_us / 1000.0))
+
+	# Only check the modules findlib imported, not the ones python starts with
+	baseline = set([name for name, self_us, cumulative_us in time_import('pass')])
+	imported = set([name for name, self_us, cumulative_us in modules]) - baseline
+	eager = [name for name in LAZY_MODULES if name in imported]
+
+	status = 0
+	if eager:
+		print('Imported modules that should be lazy: {0}'.format(', '.join(eager)))
+		status = 1
+	if median > args.budget:
+		print('Over the import budget by {0:.2f}ms'.format(median - args.budget))
+		status = 1
+	return status
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Copyright (c) 2013-2014, Matthew Brennan Jones <matthew.brennan.jones@gmail.com>
+# Py-findlib is for finding libraries and programs on most operating systems
+# It uses a MIT style license
+# It is hosted at: https://github.com/workhorsy/py-findlib
+
+# Times cache server requests over each transport: an abstract Unix socket,
+# a Unix socket file, and TCP on localhost.
+
+import os, sys
+import argparse
+import pickle
+import tempfile
+
+import benchmark
+from benchmark import findlib_server, percentile, _timer
+
+def time_requests(address, requests, files):
+	client = findlib_server.CacheFileChangeDateClient(address)
+	key = ('ver >= (1, 0)', 'libbench')
+	client.set_data(key, files)
+
+	latencies = []
+	for i in range(requests):
+		start = _timer()
+		client.get_data(key)
+		latencies.append(_timer() - start)
+	return latencies
+
+def check_codec():
+	'''
+	Makes sure names that are not UTF-8, which os.listdir returns with
+	surrogates, come back the same as single strings and in file lists.
+	'''
+	name = os.fsdecode(b'/usr/lib/libbench\xff.so') if hasattr(os, 'fsdecode') else '/usr/lib/libbench\xff.so'
+	reply = {'status':'ok', 'file':name, 'value':['/usr/lib/libbench.so', name]}
+	message = findlib_server.encode_message(reply)
+	if findlib_server.decode_message(memoryview(message)[4 : ]) != reply:
+		raise Exception('The message encoding changed a file name that is not UTF-8')
+
+def time_codec(files, rounds):
+	'''
+	Returns the seconds to encode and decode a reply with the file list,
+	with the message encoding and with pickle.
+	'''
+	reply = {'status':'ok', 'key':('ver >= (1, 0)', 'libbench'), 'value':files}
+	message = findlib_server.encode_message(reply)
+	pickled = pickle.dumps(reply)
+	times = []
+	for encode, decode, data in [
+		(findlib_server.encode_message, lambda m: findlib_server.decode_message(memoryview(m)[4 : ]), message),
+		(pickle.dumps, pickle.loads, pickled)]:
+		start = _timer()
+		for i in range(rounds):
+			encode(reply)
+		encode_time = (_timer() - start) / rounds
+		start = _timer()
+		for i in range(rounds):
+			decode(data)
+		decode_time = (_timer() - start) / rounds
+		times.append((len(data), encode_time, decode_time))
+	return times
+
+def main():
+	parser = argparse.ArgumentParser(description='Benchmark the cache server transports.')
+	parser.add_argument('--requests', type=int, default=2000, help='Requests per transport')
+	parser.add_argument('--files', type=int, default=20, help='File names in each reply')
+	args = parser.parse_args()
+
+	files = ['/usr/lib/libbench{0}.so'.format(i) for i in range(args.files)]
+	socket_dir = tempfile.mkdtemp(prefix='findlib-bench-')
+	transports = [('tcp', ('127.0.0.1', benchmark.free_tcp_port()))]
+	if findlib_server.has_unix_sockets:
+		transports.append(('unix file', os.path.join(socket_dir, 'cache.sock')))
+		if sys.platform.startswith('linux'):
+			transports.append(('unix abstract', '\0findlib-bench-{0}'.format(os.getpid())))
+
+	check_codec()
+	codec_files = ['/usr/lib/x86_64-linux-gnu/libbench{0}.so.1'.format(i) for i in range(10000)]
+	(size, encode_time, decode_time), (pickle_size, pickle_encode, pickle_decode) = time_codec(codec_files, 20)
+	print('Encoding a reply with {0} files'.format(len(codec_files)))
+	print('    message: {0} bytes, encode {1:.2f}ms, decode {2:.2f}ms'.format(size, encode_time * 1000, decode_time * 1000))
+	print('    pickle:  {0} bytes, encode {1:.2f}ms, decode {2:.2f}ms'.format(pickle_size, pickle_encode * 1000, pickle_decode * 1000))
+	print('')
+
+	print('{0} get_data requests per transport, {1} files per reply'.format(args.requests, args.files))
+	print('    {0:<16} {1:>10} {2:>9} {3:>9} {4:>9}'.format('transport', 'req/s', 'p50 us', 'p90 us', 'p99 us'))
+	try:
+		for name, address in transports:
+			server = benchmark.start_server(address)
+			if not server:
+				print('    {0:<16} did not start'.format(name))
+				continue
+			try:
+				latencies = time_requests(address, args.requests, files)
+			finally:
+				benchmark.stop_server(server)
+
+			total = sum(latencies)
+			print('    {0:<16} {1:>10.1f} {2:>9.1f} {3:>9.1f} {4:>9.1f}'.format(
+				name, len(latencies) / total,
+				percentile(latencies, 50) * 1000000,
+				percentile(latencies, 90) * 1000000,
+				percentile(latencies, 99) * 1000000))
+	finally:
+		if os.path.exists(os.path.join(socket_dir, 'cache.sock')):
+			os.remove(os.path.join(socket_dir, 'cache.sock'))
+		os.rmdir(socket_dir)
+
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Copyright (c) 2013-2014, Matthew Brennan Jones <matthew.brennan.jones@gmail.com>
+# Py-findlib is for finding libraries and programs on most operating systems
+# It uses a MIT style license
+# It is hosted at: https://github.com/workhorsy/py-findlib
+
+# Times findlib lookups against fake package databases. Runs offline on
+# any Linux box. Use --help to see the sizes that can be changed.
+
+import os, sys
+import argparse
+import socket
+import subprocess
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+FINDLIB_DIR = os.path.join(os.path.dirname(BENCH_DIR), 'findlib')
+sys.path.insert(0, FINDLIB_DIR)
+
+import findlib
+import findlib_server
+import fake_host
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+# Count the subprocesses and stat calls of each lookup
+_collector = findlib.MetricsCollector()
+findlib.add_metrics_collector(_collector)
+
+def percentile(samples, percent):
+	if not samples:
+		return 0.0
+	samples = sorted(samples)
+	i = int(round((len(samples) - 1) * percent / 100.0))
+	return samples[i]
+
+def time_calls(label, calls, before_each=None):
+	'''
+	Runs each call and returns a row of throughput, latency percentiles,
+	and subprocess and stat call counts.
+	'''
+	latencies = []
+	_collector.clear()
+	total_start = _timer()
+	for call in calls:
+		if before_each:
+			before_each()
+		start = _timer()
+		call()
+		latencies.append(_timer() - start)
+	total = _timer() - total_start
+
+	return {
+		'label' : label,
+		'count' : len(calls),
+		'per_second' : len(calls) / total if total else 0.0,
+		'p50' : percentile(latencies, 50),
+		'p90' : percentile(latencies, 90),
+		'p99' : percentile(latencies, 99),
+		'subprocesses' : sum([m.subprocesses for m in _collector.lookups]),
+		'stat_calls' : sum([m.stat_calls for m in _collector.lookups]),
+	}
+
+def print_rows(title, rows):
+	print('')
+	print(title)
+	print('    {0:<34} {1:>6} {2:>10} {3:>9} {4:>9} {5:>9} {6:>8} {7:>8}'.format(
+		'benchmark', 'calls', 'calls/s', 'p50 ms', 'p90 ms', 'p99 ms', 'procs', 'stats'))
+	for row in rows:
+		print('    {0:<34} {1:>6} {2:>10.1f} {3:>9.2f} {4:>9.2f} {5:>9.2f} {6:>8} {7:>8}'.format(
+			row['label'], row['count'], row['per_second'],
+			row['p50'] * 1000, row['p90'] * 1000, row['p99'] * 1000,
+			row['subprocesses'], row['stat_calls']))
+
+def _pick_names(names, count):
+	if count >= len(names):
+		return list(names)
+	step = float(len(names)) / count
+	return [names[int(i * step)] for i in range(count)]
+
+def _lookup_calls(names):
+	calls = []
+	for func in [findlib.get_shared_library, findlib.get_static_library, findlib.get_header_file]:
+		for name in names:
+			calls.append((func.__name__, (lambda f, n: lambda: f(n))(func, name)))
+	return calls
+
+def bench_lookups(names):
+	rows = []
+	calls = _lookup_calls(names)
+	for func_name in ['get_shared_library', 'get_static_library', 'get_header_file']:
+		func_calls = [c for n, c in calls if n == func_name]
+		rows.append(time_calls(func_name + ' cold', func_calls, findlib.clear_caches))
+		rows.append(time_calls(func_name + ' warm', func_calls))
+	return rows
+
+def bench_program_paths(host):
+	programs = ['sh', 'cat', 'grep', 'missing-program', r'gr[a-z]*']
+	calls = [(lambda p: lambda: findlib.program_paths(p))(p) for p in programs * 20]
+	return [time_calls('program_paths', calls)]
+
+def check_versioned_lookups(host):
+	'''
+	Makes sure lookups with a version string find the libraries that have
+	versions on the fake host.
+	'''
+	for name, version in sorted(host.versioned_names.items()):
+		path = findlib.get_shared_library(name, 'ver >= (1,)')
+		info = findlib.resolve_library(name, 'ver >= (1,)')
+		if not path or not path.startswith(host.root) or info.version != version:
+			raise Exception("Versioned lookup of '{0}' found {1!r}, version {2}".format(name, path, info.version))
+
+def free_tcp_port():
+	sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	sock.bind(('127.0.0.1', 0))
+	port = sock.getsockname()[1]
+	sock.close()
+	return port
+
+def start_server(address, extra_args=[]):
+	'''
+	Starts findlib_server.py listening on the address. Returns the process,
+	or None if a server is already there or it did not start.
+	'''
+	# Do not use a server that is already running, it may have old data
+	if findlib_server.is_server_running(address):
+		return None
+
+	devnull = open(os.devnull, 'w')
+	server = subprocess.Popen(
+		[sys.executable, os.path.join(FINDLIB_DIR, 'findlib_server.py'),
+			'--address', findlib_server.format_address(address)] + extra_args,
+		stdout = devnull,
+		stderr = devnull,
+		cwd = FINDLIB_DIR
+	)
+
+	# Wait for the server to listen
+	for i in range(100):
+		if findlib_server.is_server_running(address):
+			return server
+		time.sleep(0.05)
+
+	server.kill()
+	return None
+
+def stop_server(server):
+	server.terminate()
+	server.wait()
+
+def bench_cache_server(names):
+	server = start_server(findlib_server.get_cache_address())
+	if not server:
+		print('    Skipping the cache server, one is already running or it did not start')
+		return []
+
+	try:
+		rows = []
+		calls = [c for n, c in _lookup_calls(names) if n == 'get_shared_library']
+		rows.append(time_calls('cache server cold', calls, findlib.clear_caches))
+		rows.append(time_calls('cache server warm', calls, findlib.clear_caches))
+		return rows
+	finally:
+		stop_server(server)
+
+def bench_shared_cache(names):
+	'''
+	Uses one TCP cache server as if it were shared by many build hosts. Each
+	lookup starts with an empty process cache, like on a new host.
+	'''
+	address = ('127.0.0.1', free_tcp_port())
+	server = start_server(address)
+	if not server:
+		print('    Skipping the shared cache server, it did not start')
+		return []
+
+	old_address = os.environ.get('FINDLIB_CACHE_ADDRESS')
+	old_paths = findlib._package_database_paths
+	os.environ['FINDLIB_CACHE_ADDRESS'] = findlib_server.format_address(address)
+	findlib.set_use_shared_cache(True)
+	other_image = tempfile.NamedTemporaryFile(prefix='findlib-bench-')
+	try:
+		rows = []
+		calls = [c for n, c in _lookup_calls(names) if n == 'get_shared_library']
+		rows.append(time_calls('shared cache first host', calls, findlib.clear_caches))
+		rows.append(time_calls('shared cache same image', calls, findlib.clear_caches))
+
+		# A host with different packages has a different fingerprint
+		findlib._package_database_paths = old_paths + [other_image.name]
+		rows.append(time_calls('shared cache other image', calls, findlib.clear_caches))
+		return rows
+	finally:
+		other_image.close()
+		findlib._package_database_paths = old_paths
+		findlib.set_use_shared_cache(False)
+		if old_address is None:
+			del os.environ['FINDLIB_CACHE_ADDRESS']
+		else:
+			os.environ['FINDLIB_CACHE_ADDRESS'] = old_address
+		stop_server(server)
+
+def main():
+	parser = argparse.ArgumentParser(description='Benchmark findlib against fake package databases.')
+	parser.add_argument('--backends', default=','.join(fake_host.BACKENDS),
+		help='Comma separated backends to fake: {0}'.format(', '.join(fake_host.BACKENDS)))
+	parser.add_argument('--packages', type=int, default=200, help='Installed packages per host')
+	parser.add_argument('--files-per-package', type=int, default=50, help='Files in each package')
+	parser.add_argument('--fs-files', type=int, default=5000, help='Extra files in the library tree')
+	parser.add_argument('--lookups', type=int, default=20, help='Libraries to look up per benchmark')
+	parser.add_argument('--no-server', action='store_true', help='Skip the cache server benchmarks')
+	args = parser.parse_args()
+
+	# The server would answer the lookups, so the others need it stopped
+	cache_address = findlib_server.get_cache_address()
+	if findlib_server.is_server_running(cache_address):
+		print('A cache server is running on {0}. Stop it for accurate results.'.format(
+			findlib_server.format_address(cache_address)))
+		return 1
+
+	for backend in args.backends.split(','):
+		start = _timer()
+		host = fake_host.FakeHost(backend, args.packages, args.files_per_package, args.fs_files)
+		build_time = _timer() - start
+		uninstall = host.install(findlib)
+		try:
+			check_versioned_lookups(host)
+			names = _pick_names(host.library_names, args.lookups)
+			rows = bench_lookups(names)
+			rows += bench_program_paths(host)
+			if not args.no_server:
+				rows += bench_cache_server(names)
+				rows += bench_shared_cache(names)
+			print_rows('{0} ({1} packages, {2} files each, {3} fs files, built in {4:.1f}s)'.format(
+				backend, args.packages, args.files_per_package, args.fs_files, build_time), rows)
+		finally:
+			uninstall()
+			host.remove()
+
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Copyright (c) 2013-2014, Matthew Brennan Jones <matthew.brennan.jones@gmail.com>
+# Py-findlib is for finding libraries and programs on most operating systems
+# It uses a MIT style license
+# It is hosted at: https://github.com/workhorsy/py-findlib
+
+# Builds a fake host in a temp directory, with package databases, stub
+# package manager commands, and a /usr/lib style tree. Nothing on the real
+# host is read or changed, and no network is needed.
+
+import os
+import shutil
+import stat
+import tempfile
+
+# The package managers that can be faked
+BACKENDS = ['dpkg', 'rpm', 'pacman', 'slackware', 'portage', 'fs']
+
+# System programs the findlib commands need to run
+_TOOLS = ['sh', 'cat', 'grep', 'ls']
+
+_STUBS = {
+'dpkg' : '''#!/bin/sh
+case "$1" in
+	--list) cat "{db}/list" ;;
+	-L) cat "{db}/files/$2" ;;
+	*) exit 1 ;;
+esac
+''',
+'rpm' : '''#!/bin/sh
+case "$1" in
+	-qa) cat "{db}/list" ;;
+	-qi) cat "{db}/info/$2" ;;
+	-ql) cat "{db}/files/$2" ;;
+	*) exit 1 ;;
+esac
+''',
+'pacman' : '''#!/bin/sh
+case "$1" in
+	-Sl) cat "{db}/list" ;;
+	-Ql) cat "{db}/files/$2" ;;
+	*) exit 1 ;;
+esac
+''',
+'qlist' : '''#!/bin/sh
+if [ "$2" = "-I" ]; then
+	cat "{db}/list"
+else
+	cat "{db}/files/$2"
+fi
+''',
+}
+
+def _write(path, data):
+	d = os.path.dirname(path)
+	if not os.path.isdir(d):
+		os.makedirs(d)
+	with open(path, 'w') as f:
+		f.write(data)
+
+def _write_stub(bin_dir, name, source):
+	path = os.path.join(bin_dir, name)
+	_write(path, source)
+	os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+def _which(name):
+	for p in os.environ.get('PATH', '').split(os.pathsep):
+		f = os.path.join(p, name)
+		if os.path.isfile(f) and os.access(f, os.X_OK):
+			return f
+	return None
+
+class FakeHost(object):
+	'''
+	A fake host with one package manager. library_names are the names that
+	can be looked up, like "libbench7". path is the PATH that only has the
+	stub package manager and the few system tools the commands use.
+	'''
+	def __init__(self, backend, packages=200, files_per_package=50, fs_files=5000, root=None):
+		if backend not in BACKENDS:
+			raise Exception("Unknown backend: '{0}'".format(backend))
+
+		self.backend = backend
+		self.packages = packages
+		self.files_per_package = files_per_package
+		self.fs_files = fs_files
+		self.root = root or tempfile.mkdtemp(prefix='findlib-bench-')
+		self.bin_dir = os.path.join(self.root, 'bin')
+		self.db_dir = os.path.join(self.root, 'db')
+		self.lib_dir = os.path.join(self.root, 'usr', 'lib')
+		self.include_dir = os.path.join(self.root, 'usr', 'include')
+		self.slackware_dir = os.path.join(self.root, 'var', 'log', 'packages')
+		self.library_names = []
+		# Library names and the versions the fs backend should find for them
+		self.versioned_names = {}
+		self.path = None
+
+		self._build()
+
+	def _build(self):
+		# Link the system tools into the bin directory
+		os.makedirs(self.bin_dir)
+		for tool in _TOOLS:
+			real = _which(tool)
+			if real:
+				os.symlink(real, os.path.join(self.bin_dir, tool))
+		self.path = self.bin_dir
+
+		# Create the files for each package
+		packages = []
+		for i in range(self.packages):
+			name = 'libbench{0}'.format(i)
+			version = '{0}.{1}.{2}'.format(1 + i % 9, i % 40, i % 7)
+			files = self._create_package_files(name)
+			packages.append((name, version, files))
+			self.library_names.append(name)
+
+		# Create the package database for the backend
+		getattr(self, '_build_' + self.backend)(packages)
+
+		# Fill the library tree with files that do not belong to any package
+		for i in range(self.fs_files):
+			d = os.path.join(self.lib_dir, 'other{0}'.format(i // 100))
+			_write(os.path.join(d, 'libother{0}.so.{1}'.format(i, i % 5)), '')
+
+	def _create_package_files(self, name):
+		short_name = name[3 : ]
+		files = [
+			os.path.join(self.include_dir, name, short_name + '.h'),
+			os.path.join(self.lib_dir, name + '.so'),
+			os.path.join(self.lib_dir, name + '.so.1'),
+			os.path.join(self.lib_dir, name + '.a'),
+		]
+		for i in range(max(0, self.files_per_package - len(files))):
+			files.append(os.path.join(self.root, 'usr', 'share', 'doc', name, 'file{0}.txt'.format(i)))
+
+		for f in files:
+			_write(f, '')
+
+		# Package file lists also have directories in them
+		return [os.path.dirname(files[0])] + files
+
+	def _build_dpkg(self, packages):
+		db = os.path.join(self.db_dir, 'dpkg')
+		lines = []
+		for name, version, files in packages:
+			lines.append('ii  {0}-dev:amd64  1:{1}-1  amd64  Fake package'.format(name, version))
+			_write(os.path.join(db, 'files', name + '-dev'), '\n'.join(files) + '\n')
+		_write(os.path.join(db, 'list'), '\n'.join(lines) + '\n')
+		_write_stub(self.bin_dir, 'dpkg', _STUBS['dpkg'].format(db=db))
+
+	def _build_rpm(self, packages):
+		db = os.path.join(self.db_dir, 'rpm')
+		lines = []
+		for name, version, files in packages:
+			package = '{0}-devel-{1}-1.x86_64'.format(name, version)
+			lines.append(package)
+			info = 'Name        : {0}-devel\nVersion     : {1}\nRelease     : 1\n'.format(name, version)
+			_write(os.path.join(db, 'info', package), info)
+			_write(os.path.join(db, 'files', package), '\n'.join(files) + '\n')
+		_write(os.path.join(db, 'list'), '\n'.join(lines) + '\n')
+		_write_stub(self.bin_dir, 'rpm', _STUBS['rpm'].format(db=db))
+
+	def _build_pacman(self, packages):
+		db = os.path.join(self.db_dir, 'pacman')
+		lines = []
+		for name, version, files in packages:
+			lines.append('extra {0} {1}-1 [installed]'.format(name, version))
+			listing = ['{0} {1}'.format(name, f) for f in files]
+			_write(os.path.join(db, 'files', name), '\n'.join(listing) + '\n')
+		_write(os.path.join(db, 'list'), '\n'.join(lines) + '\n')
+		_write_stub(self.bin_dir, 'pacman', _STUBS['pacman'].format(db=db))
+
+	def _build_slackware(self, packages):
+		for name, version, files in packages:
+			listing = [f.lstrip('/') for f in files]
+			data = 'PACKAGE NAME: {0}-{1}-x86_64-1\nFILE LIST:\n{2}\n'.format(name, version, '\n'.join(listing))
+			_write(os.path.join(self.slackware_dir, '{0}-{1}-x86_64-1'.format(name, version)), data)
+
+	def _build_portage(self, packages):
+		db = os.path.join(self.db_dir, 'portage')
+		lines = []
+		for name, version, files in packages:
+			lines.append('dev-libs/{0}-{1}'.format(name, version))
+			_write(os.path.join(db, 'files', name), '\n'.join(files) + '\n')
+		_write(os.path.join(db, 'list'), '\n'.join(lines) + '\n')
+		_write_stub(self.bin_dir, 'qlist', _STUBS['qlist'].format(db=db))
+
+	def _build_fs(self, packages):
+		# Only the library tree, so lookups fall through to the file system.
+		# Add libraries with names that start with l, i, or b, and their
+		# versions in the file names or pkg-config files.
+		usr_dir = os.path.dirname(self.lib_dir)
+		_write(os.path.join(self.lib_dir, 'libbz2.so'), '')
+		_write(os.path.join(self.lib_dir, 'libbz2.so.1.0.8'), '')
+		_write(os.path.join(self.lib_dir, 'libldap.so'), '')
+		_write(os.path.join(self.lib_dir, 'libldap.so.2.0.200'), '')
+		_write(os.path.join(usr_dir, 'share', 'pkgconfig', 'ldap.pc'), 'Name: ldap\nVersion: 2.6.7\n')
+		_write(os.path.join(self.lib_dir, 'libblkid.so'), '')
+		_write(os.path.join(self.lib_dir, 'pkgconfig', 'blkid.pc'), 'Name: blkid\nVersion: 2.39.3\n')
+		self.versioned_names = {'bz2' : (1, 0, 8), 'ldap' : (2, 6, 7), 'blkid' : (2, 39, 3)}
+
+	def install(self, findlib):
+		'''
+		Points findlib and PATH at this fake host. Returns a callback that
+		puts them back.
+		'''
+		old = (
+			os.environ.get('PATH'),
+			findlib._library_paths,
+			findlib._ld_so_conf_dir,
+			findlib._slackware_packages_dir,
+		)
+
+		os.environ['PATH'] = self.path
+		findlib._library_paths = [self.lib_dir, self.include_dir]
+		findlib._ld_so_conf_dir = os.path.join(self.root, 'etc', 'ld.so.conf.d')
+		findlib._slackware_packages_dir = self.slackware_dir
+		findlib.clear_caches()
+		findlib.reset_backend_stats()
+
+		def uninstall():
+			os.environ['PATH'] = old[0]
+			findlib._library_paths = old[1]
+			findlib._ld_so_conf_dir = old[2]
+			findlib._slackware_packages_dir = old[3]
+			findlib.clear_caches()
+			findlib.reset_backend_stats()
+		return uninstall
+
+	def remove(self):
+		shutil.rmtree(self.root, ignore_errors=True)
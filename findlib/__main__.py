@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Copyright (c) 2013-2014, Matthew Brennan Jones <matthew.brennan.jones@gmail.com>
+# Py-findlib is for finding libraries and programs on most operating systems
+# It uses a MIT style license
+# It is hosted at: https://github.com/workhorsy/py-findlib
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# Resolves many specs in one process, and prints the results as JSON:
+#
+#     echo '[{"type": "shared", "name": "libpcre", "version": "ver >= (8, 31)"},
+#            {"type": "header", "name": "zlib"},
+#            {"type": "program", "name": "gcc"}]' | python -m findlib
+#
+# The type is one of shared, static, header, or program. The version is
+# optional. Use --trace to print a timeline of the backends and
+# subprocesses to stderr. Use --export-manifest to save the library lookups
+# for other hosts built from the same image, and --manifest to load them.
+
+import os, sys
+import argparse
+import json
+
+# The findlib modules import each other by name
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from findlib import findlib
+
+
+def _resolve(spec):
+	kind = spec.get('type', 'shared')
+	name = spec['name']
+	version = spec.get('version')
+
+	if kind == 'shared':
+		return findlib.get_shared_library(name, version)
+	elif kind == 'static':
+		return findlib.get_static_library(name, version)
+	elif kind == 'header':
+		return findlib.get_header_file(name, version)
+	elif kind == 'program':
+		return findlib.program_paths(name)
+	else:
+		raise Exception("Unknown spec type: '{0}'".format(kind))
+
+def _print_trace(out, batch_start, spec, start, elapsed, metrics):
+	out.write('+{0:9.2f}ms {1:>9.2f}ms  {2} {3}{4}\n'.format(
+		(start - batch_start) * 1000, elapsed * 1000,
+		spec.get('type', 'shared'), spec.get('name'),
+		' ({0})'.format(spec['version']) if spec.get('version') else ''))
+
+	if not metrics:
+		return
+
+	if metrics.cache_hit:
+		out.write('{0:24}cache hit\n'.format(''))
+
+	# Print the backends and commands in the order they started
+	events = []
+	for name, event_start, event_time, found in metrics.backends:
+		events.append((event_start, 'backend {0} {1}'.format(name, 'found' if found else 'missed'), event_time))
+	for command, event_start, event_time, output_bytes in metrics.commands:
+		events.append((event_start, '  $ {0} ({1} bytes)'.format(command, output_bytes), event_time))
+	events.sort(key=lambda e: e[0])
+
+	for event_start, text, event_time in events:
+		out.write('+{0:9.2f}ms {1:>9.2f}ms    {2}\n'.format(
+			(event_start - batch_start) * 1000, event_time * 1000, text))
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog='python -m findlib',
+		description='Finds libraries, headers, and programs. Reads a JSON list of specs and prints JSON results.')
+	parser.add_argument('file', nargs='?', default='-', help='JSON file of specs, or - for stdin (the default)')
+	parser.add_argument('--trace', action='store_true', help='Print a timeline of backends and subprocesses to stderr')
+	parser.add_argument('--indent', type=int, default=None, help='Indent the JSON output')
+	parser.add_argument('--manifest', default=None, help='Answer lookups from a manifest saved on a host with the same packages')
+	parser.add_argument('--export-manifest', default=None, help='Save the library lookups of the specs to a manifest file')
+	args = parser.parse_args(argv)
+
+	if args.manifest and not findlib.load_manifest(args.manifest):
+		sys.stderr.write('Not using the manifest, it is from a host with different packages: {0}\n'.format(args.manifest))
+
+	# Read the specs
+	if args.file == '-':
+		specs = json.load(sys.stdin)
+	else:
+		with open(args.file, 'r') as f:
+			specs = json.load(f)
+	if isinstance(specs, dict):
+		specs = specs.get('specs', [])
+
+	collector = findlib.MetricsCollector()
+	findlib.add_metrics_collector(collector)
+	timer = findlib._timer
+	batch_start = timer()
+
+	# Resolve each spec
+	results = []
+	for spec in specs:
+		if not isinstance(spec, dict):
+			spec = {'name' : spec}
+		result = {'type' : spec.get('type', 'shared'), 'name' : spec.get('name'), 'version' : spec.get('version')}
+		collector.clear()
+		start = timer()
+		try:
+			result['result'] = _resolve(spec)
+		except Exception as e:
+			result['result'] = None
+			result['error'] = str(e)
+		elapsed = timer() - start
+		result['time'] = elapsed
+		results.append(result)
+
+		if args.trace:
+			metrics = collector.lookups[-1] if collector.lookups else None
+			_print_trace(sys.stderr, batch_start, spec, start, elapsed, metrics)
+
+	findlib.remove_metrics_collector(collector)
+
+	if args.export_manifest:
+		lookups = [(spec['name'], spec.get('version')) for spec in specs
+			if isinstance(spec, dict) and spec.get('type', 'shared') != 'program']
+		lookups += [(spec, None) for spec in specs if not isinstance(spec, dict)]
+		findlib.export_manifest(args.export_manifest, lookups)
+
+	if args.trace:
+		sys.stderr.write('{0} specs in {1:.2f}ms\n'.format(len(specs), (timer() - batch_start) * 1000))
+
+	json.dump(results, sys.stdout, indent=args.indent)
+	sys.stdout.write('\n')
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -28,19 +28,31 @@
 
 
 import sys, os, re
-import ast
-import platform
-import subprocess
-from collections import namedtuple
+import time
+import bisect
+import threading
+from collections import OrderedDict
 
-import findlib_server
+# Modules that are slow to import, like subprocess, ast, platform, and the
+# findlib_server cache client, are imported where they are first used. So
+# importing findlib is fast for programs that only use a little of it.
 
 PY2 = sys.version_info[0] == 2
 
+# Use the most precise clock available for timing
+_timer = getattr(time, 'perf_counter', time.time)
+
 # Check if running on windows/os x
-uname = platform.system().lower().strip()
-is_windows = 'windows' in uname
-is_osx = 'darwin' in  uname
+is_windows = sys.platform == 'win32'
+is_osx = sys.platform == 'darwin'
+
+# The file extension of shared libraries
+if is_osx:
+	shared_library_extension = '.dylib'
+elif is_windows:
+	shared_library_extension = '.dll'
+else:
+	shared_library_extension = '.so'
 
 
 def chomp(s):
@@ -102,6 +114,320 @@ def _warn_symbol():
 def _fail_symbol():
 	return 'fail'
 
+class LookupMetrics(object):
+	'''
+	What happened during one library lookup. backends is a list of
+	(backend name, start, seconds, found files) in the order they ran.
+	commands is a list of (command, start, seconds, output bytes) for each
+	subprocess. Start times are from the same clock as start_time.
+	'''
+	def __init__(self, lib_name, version_str):
+		self.lib_name = lib_name
+		self.version_str = version_str
+		self.cache_hit = False
+		self.memory_hit = False
+		self.start_time = _timer()
+		self.backends = []
+		self.commands = []
+		self.subprocesses = 0
+		self.subprocess_bytes = 0
+		self.stat_calls = 0
+		self.files_found = 0
+		self.total_time = 0.0
+
+	def to_dict(self):
+		return {
+			'lib_name' : self.lib_name,
+			'version_str' : self.version_str,
+			'cache_hit' : self.cache_hit,
+			'memory_hit' : self.memory_hit,
+			'backends' : [{'name' : n, 'start' : s - self.start_time, 'time' : t, 'found' : f} for n, s, t, f in self.backends],
+			'commands' : [{'command' : c, 'start' : s - self.start_time, 'time' : t, 'bytes' : b} for c, s, t, b in self.commands],
+			'subprocesses' : self.subprocesses,
+			'subprocess_bytes' : self.subprocess_bytes,
+			'stat_calls' : self.stat_calls,
+			'files_found' : self.files_found,
+			'total_time' : self.total_time,
+		}
+
+	def __repr__(self):
+		return 'LookupMetrics({0!r}, {1:.4f}s, {2} subprocesses)'.format(self.lib_name, self.total_time, self.subprocesses)
+
+class MetricsCollector(object):
+	'''
+	A metrics callback that keeps every LookupMetrics it is given.
+	'''
+	def __init__(self):
+		self.lookups = []
+
+	def __call__(self, metrics):
+		self.lookups.append(metrics)
+
+	def clear(self):
+		self.lookups = []
+
+# Callbacks that are given a LookupMetrics after each lookup
+_metrics_collectors = []
+# The metrics of the lookup running in each thread
+_metrics_local = threading.local()
+
+def add_metrics_collector(collector):
+	if collector not in _metrics_collectors:
+		_metrics_collectors.append(collector)
+
+def remove_metrics_collector(collector):
+	if collector in _metrics_collectors:
+		_metrics_collectors.remove(collector)
+
+def _current_metrics():
+	return getattr(_metrics_local, 'current', None)
+
+def _report_metrics(metrics):
+	for collector in _metrics_collectors[:]:
+		try:
+			collector(metrics)
+		except Exception as ex:
+			pass
+
+def _is_file(path):
+	metrics = _current_metrics()
+	if metrics:
+		metrics.stat_calls += 1
+	return os.path.isfile(path)
+
+# The names of the files in each directory, keyed by directory, with its mtime
+_directory_files_cache = {}
+# Directories changed this recently may change again with the same mtime
+_directory_mtime_resolution = 2.0
+
+def _get_directory_files(directory):
+	'''
+	Returns the names of the files in the directory, or None if it can not
+	be read. The names are remembered until the directory mtime changes.
+	'''
+	metrics = _current_metrics()
+	if metrics:
+		metrics.stat_calls += 1
+	try:
+		mtime = os.stat(directory).st_mtime
+	except OSError:
+		return None
+
+	cached = _directory_files_cache.get(directory)
+	if cached and cached[0] == mtime:
+		return cached[1]
+
+	# Read the directory, and use the entry types instead of a stat for each
+	if metrics:
+		metrics.stat_calls += 1
+	names = set()
+	try:
+		for entry in os.scandir(directory):
+			try:
+				if entry.is_file():
+					names.add(entry.name)
+			except OSError:
+				pass
+	except OSError:
+		return None
+
+	if mtime < time.time() - _directory_mtime_resolution:
+		_directory_files_cache[directory] = (mtime, names)
+	return names
+
+def _iter_existing_files(paths):
+	'''
+	Yields the paths that are files, in order. Each directory is read once
+	with scandir, instead of a stat for every path.
+	'''
+	# Python 2 does not have scandir
+	if not hasattr(os, 'scandir'):
+		for path in paths:
+			if _is_file(path):
+				yield path
+		return
+
+	directories = {}
+	for path in paths:
+		directory, name = os.path.split(path)
+		if not name:
+			continue
+		directory = directory or '.'
+
+		names = directories.get(directory, False)
+		if names is False:
+			names = _get_directory_files(directory)
+			directories[directory] = names
+		if names and name in names:
+			yield path
+
+# Threads that read directories for _walk_files. Threads only help when
+# the directories are slow to read, like on network file systems.
+_walk_threads = int(os.environ.get('FINDLIB_WALK_THREADS') or 0)
+_walk_executor = None
+_walk_executor_pid = None
+_walk_executor_lock = threading.Lock()
+
+def set_walk_threads(count):
+	'''
+	Sets how many threads read directories when searching the file system.
+	Use 0 or 1 to read them in this thread.
+	'''
+	global _walk_threads, _walk_executor
+	with _walk_executor_lock:
+		if _walk_executor is not None:
+			_walk_executor.shutdown(wait=False)
+		_walk_threads = count
+		_walk_executor = None
+
+def _get_walk_executor():
+	global _walk_executor, _walk_executor_pid
+
+	if _walk_threads < 2:
+		return None
+
+	try:
+		from concurrent.futures import ThreadPoolExecutor
+	except ImportError:
+		return None
+
+	# Threads do not survive a fork, so make new ones
+	with _walk_executor_lock:
+		if _walk_executor is None or _walk_executor_pid != os.getpid():
+			_walk_executor = ThreadPoolExecutor(_walk_threads)
+			_walk_executor_pid = os.getpid()
+		return _walk_executor
+
+def _scan_directory(directory):
+	'''
+	Returns the names of the files in the directory, and the (path, id) of
+	each sub directory. Symlinks to directories are not followed, like
+	os.walk.
+	'''
+	files, dirs = [], []
+	try:
+		entries = os.scandir(directory)
+	except OSError:
+		return files, dirs
+
+	for entry in entries:
+		try:
+			if entry.is_dir(follow_symlinks=False):
+				st = entry.stat(follow_symlinks=False)
+				dirs.append((entry.path, (st.st_dev, st.st_ino)))
+			elif entry.is_file():
+				files.append(entry.name)
+		except OSError:
+			pass
+	return files, dirs
+
+def _scan_directory_with_listdir(directory):
+	# Python 2 does not have scandir
+	files, dirs = [], []
+	try:
+		names = os.listdir(directory)
+	except OSError:
+		return files, dirs
+
+	for name in names:
+		path = os.path.join(directory, name)
+		try:
+			if os.path.isdir(path):
+				if not os.path.islink(path):
+					st = os.stat(path)
+					dirs.append((path, (st.st_dev, st.st_ino)))
+			elif os.path.isfile(path):
+				files.append(name)
+		except OSError:
+			pass
+	return files, dirs
+
+def _walk_files(paths, match=None):
+	'''
+	Yields the path of every file under the paths, in the same order as
+	os.walk. match(root, name) can skip files before their path is made.
+	Each directory is only walked once, even if it is under more than one
+	of the paths. While the files of one directory are used, its sub
+	directories are read by a pool of threads.
+	'''
+	metrics = _current_metrics()
+	scan = _scan_directory if hasattr(os, 'scandir') else _scan_directory_with_listdir
+	executor = _get_walk_executor()
+	seen = set()
+	stack = []
+
+	try:
+		for path in paths:
+			try:
+				st = os.stat(path)
+			except OSError:
+				continue
+			if metrics:
+				metrics.stat_calls += 1
+			key = (st.st_dev, st.st_ino)
+			if key in seen:
+				continue
+			seen.add(key)
+
+			stack.append((path, executor.submit(scan, path) if executor else None))
+			while stack:
+				directory, pending = stack.pop()
+				files, dirs = pending.result() if pending else scan(directory)
+				if metrics:
+					metrics.stat_calls += 1 + len(dirs)
+
+				# Start reading the sub directories, in the order they will be walked
+				children = []
+				for child, key in dirs:
+					if key in seen:
+						continue
+					seen.add(key)
+					children.append((child, executor.submit(scan, child) if executor else None))
+				stack.extend(reversed(children))
+
+				for name in files:
+					if not match or match(directory, name):
+						yield os.path.join(directory, name)
+	finally:
+		# Stop reading directories nobody will use
+		for directory, pending in stack:
+			if pending:
+				pending.cancel()
+
+# Helper processes that run the commands, so this process is not forked for
+# each one. Forking is slow when this process uses a lot of memory, like
+# when it is part of a large build.
+_coprocesses = int(os.environ.get('FINDLIB_COPROCESSES') or 0)
+_coprocess_pool = None
+_coprocess_pool_pid = None
+_coprocess_pool_lock = threading.Lock()
+
+def set_coprocesses(count):
+	'''
+	Sets how many helper processes run commands. Use 0 to fork this process
+	for each command.
+	'''
+	global _coprocesses, _coprocess_pool
+	with _coprocess_pool_lock:
+		if _coprocess_pool is not None and _coprocess_pool_pid == os.getpid():
+			_coprocess_pool.close()
+		_coprocesses = count
+		_coprocess_pool = None
+
+def _get_coprocess_pool():
+	global _coprocess_pool, _coprocess_pool_pid
+
+	if is_windows or _coprocesses < 1:
+		return None
+
+	# The helpers of the parent can not be shared after a fork, so start new ones
+	import findlib_coprocess
+	with _coprocess_pool_lock:
+		if _coprocess_pool is None or _coprocess_pool_pid != os.getpid():
+			_coprocess_pool = findlib_coprocess.CoprocessPool(_coprocesses)
+			_coprocess_pool_pid = os.getpid()
+		return _coprocess_pool
+
 class ProcessRunner(object):
 	def __init__(self, command):
 		if is_windows:
@@ -117,6 +443,7 @@ class ProcessRunner(object):
 		self._stdout = None
 		self._stderr = None
 		self._status = None
+		self._start_time = None
 
 	def run(self):
 		# Recursively expand all environmental variables
@@ -126,8 +453,20 @@ class ProcessRunner(object):
 
 		self._stdout = []
 		self._stderr = []
+		self._start_time = _timer()
+
+		# Run the command in a helper process if there are any
+		pool = _get_coprocess_pool()
+		if pool:
+			import findlib_coprocess
+			try:
+				self._process = pool.popen(self._command, env)
+				return
+			except findlib_coprocess.CoprocessError:
+				pass
 
 		# Start the process and save the output
+		import subprocess
 		self._process = subprocess.Popen(
 			self._command, 
 			stderr = subprocess.PIPE, 
@@ -150,6 +489,13 @@ class ProcessRunner(object):
 		self._stderr = b''.join(self._stderr)
 		self._stdout = b''.join(self._stdout)
 
+		metrics = _current_metrics()
+		if metrics:
+			output_bytes = len(self._stdout) + len(self._stderr)
+			metrics.subprocesses += 1
+			metrics.subprocess_bytes += output_bytes
+			metrics.commands.append((self._command, self._start_time, _timer() - self._start_time, output_bytes))
+
 		# Convert strerr and stdout into unicode
 		if PY2:
 			self._stderr = unicode(self._stderr, 'UTF-8')
@@ -286,6 +632,7 @@ def expand_envs(string):
 			return string
 
 def is_safe_code(source_code):
+	import ast
 	safe_nodes = (
 		ast.Module, ast.Load, ast.Expr, ast.Attribute, ast.Name, 
 		ast.Str, ast.Num, ast.BoolOp, 
@@ -316,672 +663,1596 @@ def is_safe_code(source_code):
 
 	return True
 
-def version_string_to_tuple(version_string):
-	# Get the version number
-	Version = namedtuple('Version', 'major minor micro')
-	major, minor, micro = 0, 0, 0
+# Matches "epoch:upstream-revision" like dpkg and rpm version strings
+_version_re = re.compile(r'^(?:(\d+):)?(.*?)(?:-([^-]*))?$')
+# Matches the dotted numeric release at the start of the upstream version
+_version_release_re = re.compile(r'^\d+(?:\.\d+)*')
+# Matches pre-release tags that follow the numeric release
+_version_prerelease_re = re.compile(r'^[._+-]?(alpha|beta|pre|rc|dev)', re.IGNORECASE)
+# Splits a version into alternating non-digit and digit segments
+_version_segment_re = re.compile(r'(\D*)(\d*)')
+_version_segment_padding = ((0,), 0)
+
+def _version_char_order(c):
+	# Same character ordering as dpkg. The tilde sorts before everything,
+	# even the end of the string. Then letters sort before everything else.
+	if c == '~':
+		return -1
+	elif c.isalpha():
+		return ord(c)
+	else:
+		return ord(c) + 256
+
+def _version_segment_key(s):
+	key = []
+	for text, number in _version_segment_re.findall(s):
+		if not text and not number:
+			continue
+		text_key = tuple([_version_char_order(c) for c in text]) + (0,)
+		key.append((text_key, int(number or 0)))
+
+	# Remove trailing segments that compare the same as missing ones
+	while key and key[-1] == _version_segment_padding:
+		key.pop()
+	return tuple(key)
+
+def _compare_segment_keys(a, b):
+	# Pad the shorter key, so missing segments compare as empty
+	if len(a) < len(b):
+		a = a + (_version_segment_padding,) * (len(b) - len(a))
+	elif len(b) < len(a):
+		b = b + (_version_segment_padding,) * (len(a) - len(b))
+	return (a > b) - (a < b)
+
+class Version(object):
+	'''
+	A parsed version number like "1:2.4.5~rc1-1ubuntu2".
+
+	Comparing two Versions uses the Debian/RPM ordering rules on the epoch,
+	upstream version, and revision. Comparing a Version to a tuple like
+	(8, 31) uses only the numeric release, padded with zeros, and a
+	pre-release sorts before its release. So version strings such as
+	'ver >= (8, 31)' work against it. Instances are shared through a
+	cache, so they should be treated as read only. Since "8.31" equals
+	both (8, 31) and (8, 31, 0), no hash could agree with equality, so
+	Versions are not hashable.
+	'''
+	__slots__ = ('original', 'epoch', 'upstream', 'revision', 'release', 'prerelease', '_key')
+
+	def __init__(self, original='', epoch=0, upstream='', revision='', release=(), prerelease=False):
+		self.original = original
+		self.epoch = epoch
+		self.upstream = upstream
+		self.revision = revision
+		self.release = tuple(release)
+		self.prerelease = prerelease
+		self._key = (epoch, _version_segment_key(upstream), _version_segment_key(revision))
+
+	def _get_component(self, index):
+		if index < len(self.release):
+			return self.release[index]
+		return 0
+
+	def get_major(self):
+		return self._get_component(0)
+	major = property(get_major)
+
+	def get_minor(self):
+		return self._get_component(1)
+	minor = property(get_minor)
+
+	def get_micro(self):
+		return self._get_component(2)
+	micro = property(get_micro)
+
+	def _as_tuple(self):
+		release = self.release
+		if len(release) < 3:
+			release = release + (0,) * (3 - len(release))
+		return release
+
+	def _compare(self, other):
+		# Compare with another version using the package manager rules
+		if isinstance(other, Version):
+			a, b = self._key, other._key
+			if a[0] != b[0]:
+				return (a[0] > b[0]) - (a[0] < b[0])
+			return _compare_segment_keys(a[1], b[1]) or _compare_segment_keys(a[2], b[2])
+
+		# Compare with a tuple using the numeric release
+		a, b = self.release, tuple(other)
+		if len(a) < len(b):
+			a = a + (0,) * (len(b) - len(a))
+		elif len(b) < len(a):
+			b = b + (0,) * (len(a) - len(b))
+		if a != b:
+			return (a > b) - (a < b)
+		return -1 if self.prerelease else 0
+
+	def __eq__(self, other):
+		return self._compare(other) == 0
+
+	def __ne__(self, other):
+		return self._compare(other) != 0
+
+	def __lt__(self, other):
+		return self._compare(other) < 0
+
+	def __le__(self, other):
+		return self._compare(other) <= 0
+
+	def __gt__(self, other):
+		return self._compare(other) > 0
+
+	def __ge__(self, other):
+		return self._compare(other) >= 0
+
+	# Equal to tuples of any length, so there is no hash that agrees with __eq__
+	__hash__ = None
+
+	def __getitem__(self, index):
+		return self._as_tuple()[index]
+
+	def __iter__(self):
+		return iter(self._as_tuple())
+
+	def __len__(self):
+		return len(self._as_tuple())
+
+	def __repr__(self):
+		return 'Version({0!r})'.format(self.original)
+
+# Parsed versions, keyed by the version string
+_version_cache = {}
+
+def parse_version(version_string):
+	# Return the cached version if this string has already been parsed
 	try:
-		version = version_string.split('.')
-		major = int(version[0])
-		minor = int(version[1])
-		micro = int(version[2])
-	except Exception as e:
+		return _version_cache[version_string]
+	except (KeyError, TypeError):
 		pass
-	return Version(major, minor, micro)
 
-def to_version_cb(version_str):
-	black = {
-		'AugAssign' : 'Operation with assignment', 
-		'Assign' : 'Assignment', 
-		'Lambda' : 'Lambda function', 
-		'arguments' : 'Function argument', 
-		'arg' : 'Argument', 
-		'Param' : 'Function parameter', 
-		'Call' : 'Function call', 
-		'If' : 'If statement', 
-		'While' : 'While loop', 
-		'For' : 'For loop', 
-		'Import' : 'Importing', 
-		'ImportFrom' : 'Importing from', 
-		'alias' : 'Aliase', 
-		'ClassDef' : 'Class definition', 
-		'Pass' : 'Pass statements', 
-		'Assert' : 'Assert statement', 
-		'Break' : 'Break statement', 
-		'Continue' : 'Continue statement', 
-		'Del' : 'Del statement', 
-		'Delete' : 'Delete statement', 
-		'ExceptHandler' : 'Exception handler', 
-		'Raise' : 'Raise statement', 
-		'Try' : 'Try block', 
-		'TryExcept' : 'Try block', 
-		'TryFinally' : 'Try finally block', 
-		'Return' : 'Return statement', 
-		'Yield' : 'Yield statement', 
-		'With' : 'With statement', 
-		'Global' : 'Global statement', 
-		'Print' : 'Print statement', 
-	}
-
-	black_list = {}
-	for k, v in black.items():
-		if hasattr(ast, k):
-			t = getattr(ast, k)
-			black_list[t] = v
+	original = version_string
+	try:
+		version_string = version_string.strip()
+	except AttributeError:
+		version_string = ''
+
+	# Split the epoch, upstream version, and revision
+	epoch, upstream, revision = _version_re.match(version_string).groups()
+	epoch = int(epoch or 0)
+	revision = revision or ''
+
+	# Get the numeric release, and if it is a pre-release
+	release = ()
+	rest = upstream
+	match = _version_release_re.match(upstream)
+	if match:
+		release = tuple([int(n) for n in match.group(0).split('.')])
+		rest = upstream[match.end() : ]
+	prerelease = '~' in upstream or bool(_version_prerelease_re.match(rest))
+
+	version = Version(original, epoch, upstream, revision, release, prerelease)
+
+	try:
+		_version_cache[original] = version
+	except TypeError:
+		pass
+	return version
+
+def version_string_to_tuple(version_string):
+	return parse_version(version_string)
+
+# The names of the AST nodes that are not allowed in version strings
+_version_black_names = {
+	'AugAssign' : 'Operation with assignment', 
+	'Assign' : 'Assignment', 
+	'Lambda' : 'Lambda function', 
+	'arguments' : 'Function argument', 
+	'arg' : 'Argument', 
+	'Param' : 'Function parameter', 
+	'Call' : 'Function call', 
+	'If' : 'If statement', 
+	'While' : 'While loop', 
+	'For' : 'For loop', 
+	'Import' : 'Importing', 
+	'ImportFrom' : 'Importing from', 
+	'alias' : 'Aliase', 
+	'ClassDef' : 'Class definition', 
+	'Pass' : 'Pass statements', 
+	'Assert' : 'Assert statement', 
+	'Break' : 'Break statement', 
+	'Continue' : 'Continue statement', 
+	'Del' : 'Del statement', 
+	'Delete' : 'Delete statement', 
+	'ExceptHandler' : 'Exception handler', 
+	'Raise' : 'Raise statement', 
+	'Try' : 'Try block', 
+	'TryExcept' : 'Try block', 
+	'TryFinally' : 'Try finally block', 
+	'Return' : 'Return statement', 
+	'Yield' : 'Yield statement', 
+	'With' : 'With statement', 
+	'Global' : 'Global statement', 
+	'Print' : 'Print statement', 
+}
+_version_black_list = None
+
+def _get_version_black_list():
+	'''
+	Returns a dict of the AST node types not allowed in version strings, and
+	why, made the first time it is needed.
+	'''
+	global _version_black_list
+	if _version_black_list is None:
+		import ast
+		black_list = {}
+		for name, reason in _version_black_names.items():
+			if hasattr(ast, name):
+				black_list[getattr(ast, name)] = reason
+		_version_black_list = black_list
+	return _version_black_list
+
+class VersionConstraint(object):
+	'''
+	A compiled version string like 'ver >= (8, 31)'. Calling it with a
+	Version returns True if the version matches.
+	'''
+	__slots__ = ('version_str', '_cb')
+
+	def __init__(self, version_str, cb):
+		self.version_str = version_str
+		self._cb = cb
+
+	def __call__(self, ver):
+		return self._cb(ver)
+
+	def __repr__(self):
+		return 'VersionConstraint({0!r})'.format(self.version_str)
+
+# Compiled version constraints, keyed by the version string
+_version_constraint_cache = {}
+
+def _version_constraint_error(message):
+	_on_status('Building version string')
+	_on_fail(message)
+	_on_exit('Fix version string and try again.')
+	raise Exception(message)
+
+def compile_version_constraint(version_str):
+	# Return the cached constraint if this string has already been compiled
+	constraint = _version_constraint_cache.get(version_str)
+	if constraint:
+		return constraint
 
 	# Make sure the code can be parsed
+	import ast
 	tree = None
-	parse_error = None
 	try:
 		tree = ast.parse(version_str)
 	except SyntaxError as e:
-		parse_error = str(e)
-	if parse_error:
-		_on_status('Building version string')
-		_on_fail('Version string unparsable. "{0}", {1}'.format(version_str, parse_error))
-		_on_exit('Fix version string and try again.')
+		_version_constraint_error('Version string unparsable. "{0}", {1}'.format(version_str, e))
 
 	# Make sure each code node is not in the black list
+	black_list = _get_version_black_list()
+	black_types = tuple(black_list.keys())
+	for node in ast.walk(tree):
+		if isinstance(node, black_types):
+			for k, v in black_list.items():
+				if isinstance(node, k):
+					_version_constraint_error('{0} not allowed in version string. "{1}"'.format(v, version_str))
+
+	# Make sure the only name used is ver
 	for node in ast.walk(tree):
-		# Is in black list
-		for k, v in black_list.items():
-			if isinstance(node, k):
-				_on_status('Building version string')
-				_on_fail('{0} not allowed in version string. "{1}"'.format(v, version_str))
-				_on_exit('Fix version string and try again.')
+		if isinstance(node, ast.Name) and node.id not in ('ver', 'True', 'False', 'None'):
+			_version_constraint_error('Invalid version string "{0}", name \'{1}\' is not defined'.format(version_str, node.id))
 
 	code = "lambda ver: " + version_str
 	version_cb = None
 	# Make sure the code can be parsed into a lambda
 	try:
 		version_cb = eval(code, {})
-		version_cb(version_string_to_tuple('(1, 9)'))
 	except Exception as e:
 		message = str(e).lstrip('global ')
-		_on_status('Building version string')
-		_on_fail('Invalid version string "{0}", {1}'.format(version_str, message))
-		_on_exit('Fix version string and try again.')
-
-	return version_cb
-
-# Returns all the paths that libraries are installed in
-def _get_all_library_paths():
-	paths = ['/usr/lib', '/usr/local/lib',
-			'/usr/include', '/usr/local/include']
-	if not os.path.exists('/etc/ld.so.conf.d/'):
-		return paths
+		_version_constraint_error('Invalid version string "{0}", {1}'.format(version_str, message))
 
-	for file_name in os.listdir('/etc/ld.so.conf.d/'):
-		f = open('/etc/ld.so.conf.d/' + file_name, 'r')
-		for path in f.readlines():
-			path = path.strip()
-			if os.path.exists(path) and not path in paths:
-				paths.append(path)
+	constraint = VersionConstraint(version_str, version_cb)
+	_version_constraint_cache[version_str] = constraint
+	return constraint
 
-	return paths
+def to_version_cb(version_str):
+	return compile_version_constraint(version_str)
 
-def _get_best_match(names, desired):
+class LibraryFiles(list):
 	'''
-	Will match files with this priority:
-	1. Exact match
-	2. Exact match different capitalization
-	3. Matches start or end
-	4. Matches start or end different capitalization
+	The files found for a library. versions has the Version of the package
+	each file came from, and version is the Version of the first package.
+	backend is the name of the backend that found them. Any of them can be
+	None or missing if not known.
 	'''
+	def __init__(self, files=(), version=None, backend=None, versions=None):
+		super(LibraryFiles, self).__init__(files)
+		self.version = version
+		self.backend = backend
+		self.versions = dict(versions) if versions else {}
+		self._package_version = None
+
+	def add_version(self, version):
+		# The files appended after this are from the package with this version
+		if self.version is None:
+			self.version = version
+		self._package_version = version
+
+	def append(self, f):
+		super(LibraryFiles, self).append(f)
+		if self._package_version is not None and f not in self.versions:
+			self.versions[f] = self._package_version
+
+	def get_file_version(self, f):
+		'''
+		Returns the Version of the package the file came from.
+		'''
+		return self.versions.get(f, self.version)
+
+	def copy(self):
+		return LibraryFiles(self, self.version, self.backend, self.versions)
+
+	def to_cache(self):
+		'''
+		Returns the files as plain values that can be sent to the cache server.
+		'''
+		version = self.version.original if self.version is not None else None
+		# The files of each version, so each version string is only sent once
+		versions = {}
+		for f, file_version in self.versions.items():
+			versions.setdefault(file_version.original, []).append(f)
+		return {'files' : list(self), 'version' : version, 'versions' : versions, 'backend' : self.backend, 'times' : _get_file_times(self)}
+
+	@classmethod
+	def from_cache(cls, value):
+		# Old caches only have the list of files
+		if not value:
+			return cls()
+		elif isinstance(value, dict):
+			version = value.get('version')
+			if version is not None:
+				version = parse_version(version)
+			versions = {}
+			for file_version, files in (value.get('versions') or {}).items():
+				file_version = parse_version(file_version)
+				for f in files:
+					versions[f] = file_version
+			return cls(value.get('files') or [], version, value.get('backend'), versions)
+		else:
+			return cls(value)
 
-	# 1. Exact match
-	for name in names:
-		if name == desired:
-			return name
-
-	# 2. Exact match different capitalization
-	for name in names:
-		if name.lower() == desired.lower():
-			return name
-
-	# 3. Matches start or end
-	for name in names:
-		if name.startswith(desired) or name.endswith(desired):
-			return name
-
-	# 4. Matches start or end different capitalization
-	for name in names:
-		if name.lower().startswith(desired.lower()) or name.lower().endswith(desired.lower()):
-			return name
-
-	return None
-
-def _get_matched_file_from_library_files(library_name, extension, library_files):
+def _get_file_times(files):
 	'''
-	Will match files with this priority:
-	1. Exact match after last path separator
-	2. Exact match different capitalization after last path separator
-	3. Matches ending
-	4. Matches ending with different capitalization
+	Returns a dict of the modify time of each file that exists.
 	'''
-	library_name = library_name.lstrip('lib')
-
-	# 1. Exact match after last path separator
-	desired_name = '{0}{1}'.format(library_name, extension)
-	for entry in library_files:
-		file_name = os.path.basename(entry)
-		if file_name == desired_name:
-			return entry
-
-	# 2. Exact match different capitalization after last path separator
-	desired_name = '{0}{1}'.format(library_name, extension).lower()
-	for entry in library_files:
-		file_name = os.path.basename(entry).lower()
-		if file_name == desired_name:
-			return entry
-
-	# 3. Matches ending
-	desired_name = '{0}{1}'.format(library_name, extension)
-	for entry in library_files:
-		file_name = os.path.basename(entry)
-		if file_name.endswith(desired_name):
-			return entry
-
-	# 4. Matches ending with different capitalization
-	desired_name = '{0}{1}'.format(library_name, extension).lower()
-	for entry in library_files:
-		file_name = os.path.basename(entry).lower()
-		if file_name.endswith(desired_name):
-			return entry
-
-	return None
-
-# FIXME: Make it work with other packaging systems:
-# http://en.wikipedia.org/wiki/List_of_software_package_management_systems
-# Returns the full path of a library file or None
-def _get_library_files(lib_name, version_str = None):
-	files = []
-
-	# Create a version_cb from the string
-	version_cb = None
-	if version_str:
-		version_cb = to_version_cb(version_str)
-	search_param = (version_str, lib_name)
+	times = {}
+	for f in files:
+		try:
+			times[f] = os.path.getmtime(f)
+		except OSError:
+			pass
+	return times
 
-	# If the query is cached, and none of the resulting files have 
-	# changed, return the cache.
-	cacher = None
-	files = None
-	try:
-		cacher = findlib_server.CacheFileChangeDateClient()
-		files = cacher.get_data(search_param)
-		none_have_changed = True
-		if files:
-			for entry in files:
-				response = cacher.has_file_changed(entry)
-				has_changed = response['has_changed']
-				if has_changed == True:
-					none_have_changed = False
-
-			if none_have_changed:
-				return files
-	except Exception as ex:
-		pass
+def _have_files_changed(files, times):
+	'''
+	Returns True if any of the files is gone or was modified after its time
+	was saved with to_cache.
+	'''
+	for f in files:
+		try:
+			if os.path.getmtime(f) != times[f]:
+				return True
+		except (OSError, KeyError):
+			return True
+	return False
 
-	# Try finding with dpkg
-	if not files:
-		files = _get_library_files_from_dpkg(lib_name, version_cb)
+class MemoCache(object):
+	'''
+	A thread safe cache that forgets the least recently used entries when
+	it is full, and entries older than their time to live in seconds.
+	'''
+	def __init__(self, max_entries=256, ttl=60.0):
+		self.max_entries = max_entries
+		self.ttl = ttl
+		self._entries = OrderedDict()
+		self._lock = threading.Lock()
+
+	def get(self, key):
+		'''
+		Returns (True, value) if the key is cached, or (False, None).
+		'''
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is None:
+				return False, None
+
+			# Forget the entry if it is too old
+			value, expires = entry
+			if expires < _timer():
+				del self._entries[key]
+				return False, None
+
+			# Move the entry to the end, so it is the most recently used
+			del self._entries[key]
+			self._entries[key] = entry
+			return True, value
+
+	def set(self, key, value, ttl=None):
+		if ttl is None:
+			ttl = self.ttl
+		if not self.max_entries or ttl <= 0:
+			return
+
+		with self._lock:
+			self._entries.pop(key, None)
+			self._entries[key] = (value, _timer() + ttl)
+
+			# Forget the least recently used entries
+			while len(self._entries) > self.max_entries:
+				self._entries.popitem(last=False)
+
+	def invalidate(self, match=None):
+		'''
+		Forgets all the entries, or only the ones where match(key, value) is True.
+		'''
+		with self._lock:
+			if match is None:
+				self._entries.clear()
+				return
+			for key in [k for k, (v, e) in self._entries.items() if match(k, v)]:
+				del self._entries[key]
+
+	def __len__(self):
+		return len(self._entries)
+
+# The files of recent lookups in this process, keyed by (version_str, lib_name),
+# or by (version_str, lib_name, extension) for the one file of a lookup that
+# stopped early in another process
+_library_files_cache = MemoCache(256, 60.0)
+# Seconds to remember that a library was not found
+_negative_cache_ttl = 300.0
+
+class _Miss(object):
+	'''
+	A cached lookup that found nothing. It is only valid while the package
+	databases have the same fingerprint.
+	'''
+	__slots__ = ('fingerprint',)
 
-	# Try finding with rpm
-	if not files:
-		files = _get_library_files_from_rpm(lib_name, version_cb)
+	def __init__(self, fingerprint):
+		self.fingerprint = fingerprint
 
-	# Try finding with pacman
-	if not files:
-		files = _get_library_files_from_pacman(lib_name, version_cb)
+class _PartialSearch(object):
+	'''
+	A cached lookup that stopped early at the file it wanted. It keeps the
+	files found so far and the rest of the search, so lookups for other
+	files of the library carry on from there, instead of starting over.
+	'''
+	__slots__ = ('files', 'remaining', 'lock')
+
+	def __init__(self, files, remaining):
+		self.files = files
+		self.remaining = remaining
+		self.lock = threading.Lock()
+
+	def search(self, lib_name, extension):
+		'''
+		Returns the files, and True if the search is done. With an extension,
+		it only goes on until the exact file for it is found.
+		'''
+		with self.lock:
+			if self.remaining is None:
+				return self.files.copy(), True
+
+			if extension:
+				names = _get_desired_file_names(lib_name, extension)
+				for f in self.files:
+					if os.path.basename(f) in names:
+						return self.files.copy(), False
+				for f in self.remaining:
+					if os.path.basename(f) in names:
+						return self.files.copy(), False
+			else:
+				for f in self.remaining:
+					pass
 
-	# Try finding with slackware
-	if not files:
-		files = _get_library_files_from_slackware(lib_name, version_cb)
+			self.remaining = None
+			return self.files.copy(), True
 
-	# Try finding with portage
-	if not files:
-		files = _get_library_files_from_portage(lib_name, version_cb)
+def configure_negative_cache(ttl):
+	'''
+	Sets how many seconds a library that was not found is remembered. It is
+	also forgotten when packages are installed or removed. Use 0 to turn
+	it off.
+	'''
+	global _negative_cache_ttl
+	_negative_cache_ttl = ttl
+	_library_files_cache.invalidate(lambda key, value: isinstance(value, _Miss))
 
-	# Try finding with pkg_info
-	if not files:
-		files = _get_library_files_from_pkg_info(lib_name, version_cb)
+def configure_library_cache(max_entries=None, ttl=None):
+	'''
+	Sets how many lookups are remembered in this process, and for how many
+	seconds. Use 0 for either to turn it off.
+	'''
+	if max_entries is not None:
+		_library_files_cache.max_entries = max_entries
+	if ttl is not None:
+		_library_files_cache.ttl = ttl
+	_library_files_cache.invalidate()
 
-	# Try finding with ports
-	if not files:
-		files = _get_library_files_from_ports(lib_name, version_cb)
+def invalidate_library_cache(lib_name=None):
+	'''
+	Forgets the remembered lookups of a library, or of all libraries. Call
+	this after installing or removing packages.
+	'''
+	if lib_name is None:
+		_library_files_cache.invalidate()
+	else:
+		_library_files_cache.invalidate(lambda key, value: key[1] == lib_name)
 
-	# Try finding with pkg-config
-	if not files:
-		files = _get_library_files_from_pkg_config(lib_name, version_cb)
-	
-	# Try finding with the file system. But only if there is no version requirement.
-	if not version_cb and not files:
-		files = _get_library_files_from_fs(lib_name)
+def clear_caches():
+	'''
+	Forgets everything cached in this process, so the next lookup is cold.
+	'''
+	_version_cache.clear()
+	_version_constraint_cache.clear()
+	_library_files_cache.invalidate()
+	_directory_files_cache.clear()
+	_needed_library_cache.clear()
+	_package_indexes.clear()
+	if 'findlib_elf' in sys.modules:
+		sys.modules['findlib_elf'].clear_elf_cache()
+	if 'findlib_backends' in sys.modules:
+		sys.modules['findlib_backends'].clear_caches()
+	reset_backend_probes()
+
+# Where libraries, linker configs, and slackware packages are installed
+_library_paths = ['/usr/lib', '/usr/local/lib',
+		'/usr/include', '/usr/local/include']
+_ld_so_conf_dir = '/etc/ld.so.conf.d/'
+_slackware_packages_dir = '/var/log/packages'
+
+# Files and directories that change when packages are installed or removed
+_package_database_paths = [
+	'/var/lib/dpkg/status',
+	'/var/lib/rpm',
+	'/var/lib/pacman/local',
+	'/var/db/pkg',
+	'/opt/local/var/macports/registry',
+	'/etc/ld.so.cache',
+]
+
+def package_database_fingerprint():
+	'''
+	Returns a tuple of (path, modify time) for each package database on
+	this host. It changes when packages are installed or removed.
+	'''
+	return _get_paths_fingerprint(_package_database_paths + [_slackware_packages_dir])
 
-	# Save the file names in the cache
-	if cacher and files:
+def _get_paths_fingerprint(paths):
+	# Returns a tuple of (path, modify time) for each path that exists
+	fingerprint = []
+	for path in paths:
 		try:
-			cacher.set_data(search_param, files)
-		except Exception as ex:
+			fingerprint.append((path, os.path.getmtime(path)))
+		except OSError:
 			pass
+	return tuple(fingerprint)
 
-	return files
-
-def _get_library_files_from_pkg_config(lib_name, version_cb = None):
-	matching_files = []
-	lib_name = lib_name.lstrip('lib')
-
-	# Just return if there is no pkg-config
-	if not program_paths('pkg-config'):
-		return matching_files
-
-	# Find all packages that contain the name
-	result = run_and_get_stdout("pkg-config --list-all | grep -i {0}".format(lib_name))
-	if not result:
-		return matching_files
-
-	# For each package
-	for package in result.split("\n"):
-		# Get the name
-		name = package.split()[0]
-
-		# Skip this package if the library name is not in the package name
-		if not lib_name.lower() in name.lower():
-			continue
-
-		# Get the version, libdir, and includedir
-		version = run_and_get_stdout("pkg-config --modversion {0}".format(name))
-		libdir = run_and_get_stdout("pkg-config --variable=libdir {0}".format(name))
-		includedir = run_and_get_stdout("pkg-config --variable=includedir {0}".format(name))
-		if not version or not libdir or not includedir:
-			continue
-		version = version_string_to_tuple(version)
-
-		# Skip this package if the version does not match
-		if version_cb and not version_cb(version):
-			continue
-
-		# Get the library files in those directories
-		for d in [libdir, includedir]:
-			for root, dirs, files in os.walk(d):
-				for entry in files:
-					# Get the whole file name
-					f = os.path.join(root, entry)
-
-					# Save the file if the name is in the root
-					if lib_name.lower() in root.lower():
-						matching_files.append(f)
-					# Save the file if the lib name is in the file
-					elif 'lib' + lib_name.lower() in entry.lower():
-						matching_files.append(f)
-
-	return matching_files
-
-def _get_library_files_from_ports(lib_name, version_cb = None):
-	matching_files = []
-	lib_name = lib_name.lstrip('lib')
-
-	# Just return if there is no port
-	if not program_paths('port'):
-		return matching_files
-
-	# Find all packages that contain the name
-	result = run_and_get_stdout("port list | grep -i {0}".format(lib_name))
-	if not result:
-		return matching_files
-
-	# For each package
-	for package in result.split("\n"):
-		# Get the name
-		name = package.split()[0]
-
-		# Skip if the library name is not in the package name
-		if not lib_name.lower() in name.lower():
-			continue
+class _PackageIndex(object):
+	'''
+	The lines of a package listing, like the output of "dpkg --list", with
+	a trigram index. Finds the lines with a name in them without looking at
+	every line, ignoring case like "grep -i". The index is made on the
+	second search, since making it takes longer than one scan of the lines.
+	'''
+	def __init__(self, lines):
+		self.lines = [line for line in lines if line.strip()]
+		self._lower_lines = [line.lower() for line in self.lines]
+		self._trigrams = None
+		self._sorted = None
+		self._searches = 0
+
+	def _make_trigrams(self):
+		trigrams = {}
+		for i, line in enumerate(self._lower_lines):
+			for trigram in set([line[j : j + 3] for j in range(len(line) - 2)]):
+				trigrams.setdefault(trigram, []).append(i)
+		self._trigrams = trigrams
+
+	def search(self, text):
+		'''
+		Returns the lines that contain the text, in listing order.
+		'''
+		text = text.lower()
+		self._searches += 1
+		if self._trigrams is None and self._searches > 1:
+			self._make_trigrams()
+
+		if len(text) < 3 or self._trigrams is None:
+			candidates = range(len(self.lines))
+		else:
+			# Only the lines with the rarest trigram of the text can match
+			candidates = None
+			for j in range(len(text) - 2):
+				posting = self._trigrams.get(text[j : j + 3])
+				if not posting:
+					return []
+				if candidates is None or len(posting) < len(candidates):
+					candidates = posting
+		return [self.lines[i] for i in candidates if text in self._lower_lines[i]]
+
+	def starts_with(self, text):
+		'''
+		Returns the lines that start with the text, in listing order.
+		'''
+		text = text.lower()
+		if self._sorted is None:
+			self._sorted = sorted([(line, i) for i, line in enumerate(self._lower_lines)])
+		start = end = bisect.bisect_left(self._sorted, (text, -1))
+		while end < len(self._sorted) and self._sorted[end][0].startswith(text):
+			end += 1
+		return [self.lines[i] for i in sorted([i for line, i in self._sorted[start : end]])]
+
+# The _PackageIndex of each listing command, with the package database
+# fingerprint it was made with
+_package_indexes = {}
+_package_indexes_lock = threading.Lock()
+
+def _get_package_index(command, paths):
+	'''
+	Returns a _PackageIndex of the output of the listing command. The command
+	is only run again after packages are installed or removed, or one of the
+	paths the listing is read from changes.
+	'''
+	fingerprint = package_database_fingerprint() + _get_paths_fingerprint(paths)
+	with _package_indexes_lock:
+		cached = _package_indexes.get(command)
+	if cached and cached[0] == fingerprint:
+		return cached[1]
+
+	result = run_and_get_stdout(command)
+	index = _PackageIndex(result.split("\n") if result else [])
+	with _package_indexes_lock:
+		_package_indexes[command] = (fingerprint, index)
+	return index
 
-		# Skip if not a devel package
-		if not package.split()[2].startswith('devel/'):
-			continue
+# Returns all the paths that libraries are installed in
+def _get_all_library_paths():
+	paths = list(_library_paths)
+	if not os.path.exists(_ld_so_conf_dir):
+		return paths
 
-		# Get the version
-		version = package.split()[1].lstrip('@')
-		if not version:
-			continue
-		version = version_string_to_tuple(version)
+	for file_name in os.listdir(_ld_so_conf_dir):
+		f = open(os.path.join(_ld_so_conf_dir, file_name), 'r')
+		for path in f.readlines():
+			path = path.strip()
+			if os.path.exists(path) and not path in paths:
+				paths.append(path)
 
-		# Skip if the version does not match
-		if version_cb and not version_cb(version):
-			continue
+	return paths
 
-		# Get the files and skip if there are none
-		library_files = run_and_get_stdout("port contents {0}".format(name))
-		if not library_files:
-			continue
+def _rank_matches(entries, desired, get_name, match_start, first_only, also_exact=None):
+	'''
+	Ranks the entries in one pass. Each entry's name is only computed and
+	lower cased once. Returns the best entry if first_only is True, or a
+	list of all the matching entries ordered by tier. If first_only is True,
+	it stops at the first exact match, so entries can be a generator.
+	'''
+	desired_lower = desired.lower()
+	tiers = ([], [], [], [])
 
-		# Get the valid files
-		for entry in library_files.split("\n"):
-			entry = entry.strip()
-			if os.path.isfile(entry):
-				matching_files.append(entry)
-
-	return matching_files
-
-def _get_library_files_from_fs(lib_name):
-	matching_files = []
-	lib_name = lib_name.lstrip('lib')
-
-	for path in _get_all_library_paths():
-		for root, dirs, files in os.walk(path):
-			for entry in files:
-				# Get the whole file name
-				f = os.path.join(root, entry)
-				if lib_name in f and os.path.isfile(f):
-					matching_files.append(f)
-
-	return matching_files
-
-def _get_library_files_from_pacman(lib_name, version_cb = None):
-	matching_files = []
-	lib_name = lib_name.lstrip('lib')
-
-	# Just return if there is no pacman
-	if not program_paths('pacman'):
-		return matching_files
-
-	# Find all packages that contain the name
-	result = run_and_get_stdout("pacman -Sl | grep -i {0}".format(lib_name))
-	if not result:
-		return matching_files
-
-	# Get the best package name
-	packages = [p.split()[1] for p in result.split("\n")]
-	best_name = _get_best_match(packages, lib_name)
-	if not best_name:
-		return matching_files
-
-	# For each package
-	for package in result.split("\n"):
-		# Get the name
-		name = package.split()[1]
-
-		# Skip this package if it is not the best name
-		if not best_name == name:
-			continue
+	for entry in entries:
+		name = get_name(entry) if get_name else entry
 
-		# Skip this package if the library name is not in the package name
-		if not lib_name.lower() in name.lower():
+		# 1. Exact match
+		if name == desired or name == also_exact:
+			if first_only:
+				return entry
+			tiers[0].append(entry)
 			continue
 
-		# Get the version
-		version = package.split()[2]
-		version = version.split('-')[0]
-		version = version_string_to_tuple(version)
+		lower = name.lower()
+
+		# 2. Exact match different capitalization
+		if lower == desired_lower:
+			tiers[1].append(entry)
+		# 3. Matches ending (or start)
+		elif name.endswith(desired) or (match_start and name.startswith(desired)):
+			tiers[2].append(entry)
+		# 4. Matches ending (or start) with different capitalization
+		elif lower.endswith(desired_lower) or (match_start and lower.startswith(desired_lower)):
+			tiers[3].append(entry)
+
+	if first_only:
+		for tier in tiers:
+			if tier:
+				return tier[0]
+		return None
 
-		# Skip this package if the version does not match
-		if version_cb and not version_cb(version):
-			continue
+	return tiers[0] + tiers[1] + tiers[2] + tiers[3]
 
-		# Get the library files
-		result = run_and_get_stdout('pacman -Ql {0}'.format(name))
-		if not result:
-			continue
+def rank_names(names, desired):
+	'''
+	Returns all the names that match, with this priority:
+	1. Exact match
+	2. Exact match different capitalization
+	3. Matches start or end
+	4. Matches start or end different capitalization
+	'''
+	return _rank_matches(names, desired, None, True, False)
 
-		# Save all the files
-		for entry in result.split("\n"):
-			entry = entry.split()[1]
-			if os.path.isfile(entry):
-				matching_files.append(entry)
+def _get_desired_file_names(library_name, extension):
+	'''
+	Returns the file name to match, and the same name with the lib prefix.
+	'''
+	# Remove the lib prefix, not every leading l, i, and b like lstrip would
+	bare_name = library_name[3 : ] if library_name.startswith('lib') else library_name
+	return bare_name + extension, 'lib' + bare_name + extension
 
-	return matching_files
+def rank_library_files(library_name, extension, library_files):
+	'''
+	Returns all the files that match, with this priority:
+	1. Exact match after last path separator, with or without the lib prefix
+	2. Exact match different capitalization after last path separator
+	3. Matches ending
+	4. Matches ending with different capitalization
+	'''
+	desired_name, prefixed_name = _get_desired_file_names(library_name, extension)
+	return _rank_matches(library_files, desired_name, os.path.basename, False, False, prefixed_name)
 
-def _get_library_files_from_dpkg(lib_name, version_cb = None):
-	matching_files = []
+def _get_best_match(names, desired):
+	return _rank_matches(names, desired, None, True, True)
 
-	# Just return if there is no dpkg
-	if not program_paths('dpkg'):
-		return matching_files
+def _get_matched_file_from_library_files(library_name, extension, library_files):
+	desired_name, prefixed_name = _get_desired_file_names(library_name, extension)
+	return _rank_matches(library_files, desired_name, os.path.basename, False, True, prefixed_name)
 
-	# Find all packages that contain the name
-	result = run_and_get_stdout("dpkg --list | grep -i {0}".format(lib_name))
-	if not result:
-		return matching_files
+class Backend(object):
+	'''
+	A way of finding the files of an installed library. The probe is called
+	once to see if the backend is installed. The find_files callback is
+	called with (lib_name, version_cb) and returns a list of file paths.
+	Backends with a lower priority number are tried first.
+
+	Instead of find_files, a backend can have an iter_files generator. It is
+	called with (lib_name, version_cb, library_files), yields the file paths
+	one at a time, and calls library_files.add_version for each package.
+	Lookups for one file stop it as soon as the exact file is found.
+	'''
+	def __init__(self, name, find_files, probe=None, priority=100, supports_versions=True, iter_files=None):
+		if not find_files and iter_files:
+			find_files = _collect_library_files(iter_files)
+		self.name = name
+		self.find_files = find_files
+		self.iter_files = iter_files
+		self.probe = probe
+		self.priority = priority
+		self.supports_versions = supports_versions
+
+	def __repr__(self):
+		return 'Backend({0!r}, priority={1})'.format(self.name, self.priority)
+
+def _collect_library_files(iter_files):
+	def find_files(lib_name, version_cb = None):
+		# Append each file, so it is saved with the version of its package
+		library_files = LibraryFiles()
+		for f in iter_files(lib_name, version_cb, library_files):
+			library_files.append(f)
+		return library_files
+	return find_files
+
+def _record_library_files(files, library_files):
+	for entry in files:
+		library_files.append(entry)
+		yield entry
+
+def _search_backend(backend, lib_name, version_cb, extension):
+	'''
+	Returns the files the backend found, and the rest of the search if it
+	was stopped early at the exact file for the extension, or None. Then
+	the files are not complete.
+	'''
+	if not extension or not backend.iter_files:
+		found = backend.find_files(lib_name, version_cb)
+		if not isinstance(found, LibraryFiles):
+			found = LibraryFiles(found or [])
+		return found, None
+
+	found = LibraryFiles()
+	desired_name, prefixed_name = _get_desired_file_names(lib_name, extension)
+	files = _record_library_files(backend.iter_files(lib_name, version_cb, found), found)
+	match = _rank_matches(files, desired_name, os.path.basename, False, True, prefixed_name)
+	if match is not None and os.path.basename(match) in (desired_name, prefixed_name):
+		return found, files
+	return found, None
+
+# All the registered backends, sorted by priority
+_backends = []
+# The backends that were found installed, or None if not probed yet
+_available_backends = None
+
+# The built in backends are in findlib_backends, which is only imported
+# when the backends are first used
+_builtin_backends_loaded = False
+_builtin_backends_lock = threading.Lock()
+
+def _load_builtin_backends():
+	global _builtin_backends_loaded
+
+	if _builtin_backends_loaded:
+		return
+
+	with _builtin_backends_lock:
+		if not _builtin_backends_loaded:
+			import findlib_backends
+			findlib_backends.load_backends(sys.modules[__name__], _add_backend)
+			_builtin_backends_loaded = True
+
+def register_backend(name, find_files, probe=None, priority=100, supports_versions=True, iter_files=None):
+	_load_builtin_backends()
+	return _add_backend(name, find_files, probe, priority, supports_versions, iter_files)
+
+def _add_backend(name, find_files, probe=None, priority=100, supports_versions=True, iter_files=None):
+	global _available_backends
+
+	# Replace any backend with the same name
+	_remove_backend(name)
+
+	backend = Backend(name, find_files, probe, priority, supports_versions, iter_files)
+	_backends.append(backend)
+	_backends.sort(key=lambda b: b.priority)
+
+	# Only probe the new backend, instead of all of them again
+	if _available_backends is not None:
+		if _probe_backend(backend):
+			_available_backends = [b for b in _backends if b in _available_backends or b is backend]
+
+	return backend
+
+def unregister_backend(name):
+	_load_builtin_backends()
+	_remove_backend(name)
+
+def _remove_backend(name):
+	global _available_backends
+
+	for backend in _backends[:]:
+		if backend.name == name:
+			_backends.remove(backend)
+			if _available_backends is not None and backend in _available_backends:
+				_available_backends = [b for b in _available_backends if b is not backend]
+
+def get_backends():
+	_load_builtin_backends()
+	return list(_backends)
+
+def _probe_backend(backend):
+	if not backend.probe:
+		return True
 
-	# For each package
-	for package in result.split("\n"):
-		# Get the name and version
-		name = before(package.split()[1], ':')
-		version = between_last(package.split()[2], ':', '-')
-		version = version_string_to_tuple(version)
+	try:
+		return bool(backend.probe())
+	except Exception as e:
+		return False
 
-		# Skip this package if the library name is not in the package name
-		if not lib_name.lower() in name.lower():
-			continue
+def get_available_backends():
+	'''
+	Returns the backends that are installed, in priority order. Each backend
+	is only probed the first time, or after reset_backend_probes is called.
+	'''
+	global _available_backends
+
+	_load_builtin_backends()
+	if _available_backends is None:
+		_available_backends = [b for b in _backends if _probe_backend(b)]
+
+	return _available_backends
+
+def reset_backend_probes():
+	global _available_backends
+	_available_backends = None
+
+class BackendStats(object):
+	__slots__ = ('calls', 'hits', 'total_time')
+
+	def __init__(self, calls=0, hits=0, total_time=0.0):
+		self.calls = calls
+		self.hits = hits
+		self.total_time = total_time
+
+	def get_hit_rate(self):
+		if not self.calls:
+			return 0.0
+		return float(self.hits) / self.calls
+	hit_rate = property(get_hit_rate)
+
+	def get_average_time(self):
+		if not self.calls:
+			return 0.0
+		return self.total_time / self.calls
+	average_time = property(get_average_time)
+
+	def get_cost(self):
+		# The expected time spent in this backend for each hit
+		if not self.hits:
+			return None
+		return self.total_time / self.hits
+	cost = property(get_cost)
+
+# Hit statistics for each backend, keyed by backend name
+_backend_stats = {}
+# The stats from this process not yet added to the cache, as [calls, hits, total_time]
+_backend_stats_unsaved = {}
+# The key the backend stats are saved under in the cache
+_backend_stats_key = ('__findlib__', 'backend_stats')
+_backend_stats_loaded = False
+_backend_stats_was_reset = False
+
+def _get_backend_stats_key():
+	# Hosts sharing a cache server only share stats with hosts from the same image
+	if _use_shared_cache:
+		return (host_image_fingerprint(),) + _backend_stats_key
+	return _backend_stats_key
+# Backends need this many hits before they can be moved ahead
+_adaptive_min_hits = 3
+# Reorder backends by their hit statistics, unless strict order was asked for
+_adaptive_backend_order = not os.environ.get('FINDLIB_STRICT_BACKEND_ORDER')
+
+def set_adaptive_backend_order(is_enabled):
+	'''
+	If enabled, backends that have answered queries before are tried first,
+	cheapest first. If disabled, backends are always tried in strict
+	priority order.
+	'''
+	global _adaptive_backend_order
+	_adaptive_backend_order = bool(is_enabled)
+
+def get_backend_stats():
+	stats = {}
+	for name, stat in _backend_stats.items():
+		stats[name] = {
+			'calls' : stat.calls,
+			'hits' : stat.hits,
+			'hit_rate' : stat.hit_rate,
+			'average_time' : stat.average_time,
+		}
+	return stats
+
+def reset_backend_stats():
+	global _backend_stats_was_reset
+	_backend_stats.clear()
+	_backend_stats_unsaved.clear()
+	_backend_stats_was_reset = True
+
+def _record_backend_result(backend, elapsed, is_hit):
+	stat = _backend_stats.get(backend.name)
+	if not stat:
+		stat = BackendStats()
+		_backend_stats[backend.name] = stat
+	stat.calls += 1
+	stat.total_time += elapsed
+	if is_hit:
+		stat.hits += 1
+
+	# Keep what changed, so only that is added to the cache
+	unsaved = _backend_stats_unsaved.get(backend.name)
+	if not unsaved:
+		unsaved = [0, 0, 0.0]
+		_backend_stats_unsaved[backend.name] = unsaved
+	unsaved[0] += 1
+	unsaved[1] += 1 if is_hit else 0
+	unsaved[2] += elapsed
+
+def _load_backend_stats(cacher):
+	global _backend_stats_loaded
+	if _backend_stats_loaded:
+		return
+	_backend_stats_loaded = True
+
+	# Add the saved stats to any from this process. They are only read
+	# once, since this process only sends its own changes back
+	try:
+		saved = cacher.get_data(_get_backend_stats_key())
+	except Exception as ex:
+		return
+	if not saved:
+		return
+	for name, (calls, hits, total_time) in saved.items():
+		stat = _backend_stats.get(name)
+		if not stat:
+			stat = BackendStats()
+			_backend_stats[name] = stat
+		stat.calls += calls
+		stat.hits += hits
+		stat.total_time += total_time
+
+def _save_backend_stats(cacher):
+	global _backend_stats_was_reset
+	if not _backend_stats_unsaved and not _backend_stats_was_reset:
+		return
+
+	# Send only the changes, so the server adds them to the stats of other
+	# processes, instead of one process overwriting the rest
+	changes = {}
+	for name, (calls, hits, total_time) in _backend_stats_unsaved.items():
+		changes[name] = (calls, hits, total_time)
+	try:
+		if _backend_stats_was_reset:
+			cacher.set_data(_get_backend_stats_key(), changes)
+		else:
+			cacher.add_data(_get_backend_stats_key(), changes)
+		_backend_stats_unsaved.clear()
+		_backend_stats_was_reset = False
+	except Exception as ex:
+		pass
 
-		# Skip this package if the version does not match
-		if version_cb and not version_cb(version):
-			continue
+def _get_ordered_backends():
+	'''
+	Returns the available backends in the order they should be tried. With
+	adaptive ordering, backends with enough hits go first, cheapest first.
+	The rest follow in priority order.
+	'''
+	backends = get_available_backends()
+	if not _adaptive_backend_order or not _backend_stats:
+		return backends
+
+	proven, unproven = [], []
+	for backend in backends:
+		stat = _backend_stats.get(backend.name)
+		if stat and stat.hits >= _adaptive_min_hits:
+			proven.append((stat.cost, backend.priority, backend))
+		else:
+			unproven.append(backend)
 
-		# Get all the files and directories
-		result = run_and_get_stdout("dpkg -L {0}".format(name))
-		if not result:
-			continue
+	if not proven:
+		return backends
 
-		# Save all the files
-		library_entries = result.split("\n")
-		for entry in library_entries:
-			if os.path.isfile(entry):
-				matching_files.append(entry)
+	proven.sort(key=lambda p: (p[0], p[1]))
+	return [p[2] for p in proven] + unproven
 
-	return matching_files
+# Ask the resolution daemon to find libraries, instead of finding them here
+_use_resolution_daemon = bool(os.environ.get('FINDLIB_DAEMON'))
 
-def _get_library_files_from_rpm(lib_name, version_cb = None):
-	lib_name = lib_name.lstrip('lib')
-	matching_files = []
+def set_use_resolution_daemon(is_enabled):
+	global _use_resolution_daemon
+	_use_resolution_daemon = bool(is_enabled)
 
-	# Just return if there is no rpm
-	if not program_paths('rpm'):
-		return matching_files
+# Share the cache server with other hosts built from the same image
+_use_shared_cache = bool(os.environ.get('FINDLIB_SHARED_CACHE'))
 
-	# Find all packages that contain the name
-	result = run_and_get_stdout("rpm -qa | grep -i {0}".format(lib_name))
-	if not result:
-		return matching_files
+def set_use_shared_cache(is_enabled):
+	'''
+	If enabled, the cache server entries are keyed by host_image_fingerprint
+	instead of being checked against the files on this host. Many build
+	hosts can then share one cache server, and hosts with the same packages
+	use each other's lookups.
+	'''
+	global _use_shared_cache
+	_use_shared_cache = bool(is_enabled)
 
-	# For each package
-	for package in result.split("\n"):
-		# Get the name and version
-		result = run_and_get_stdout("rpm -qi {0}".format(package))
-		if not result:
-			continue
-		name = between(result, 'Name        : ', '\n')
-		version = between(result, 'Version     : ', '\n')
-		version = version_string_to_tuple(version)
+def host_image_fingerprint():
+	'''
+	Returns a short string that is the same on hosts with the same machine
+	type and package databases, like containers made from one image.
+	'''
+	import hashlib
+	import platform
+	data = repr((platform.machine(), sys.platform, package_database_fingerprint()))
+	return hashlib.sha1(data.encode('utf-8')).hexdigest()[0 : 16]
+
+# The lookups in the loaded resolution manifest, keyed by (version_str, lib_name)
+_manifest = None
+_manifest_fingerprint = None
+# A manifest to load before the first lookup
+_manifest_path = os.environ.get('FINDLIB_MANIFEST')
+# Changes when the manifest tables change
+_manifest_format = 2
+
+def export_manifest(path, lookups):
+	'''
+	Finds each library, and saves the results and the package database
+	fingerprint of this host to a sqlite file. Hosts built from the same
+	image can load it with load_manifest or FINDLIB_MANIFEST, instead of
+	finding the libraries again. lookups are library names, or
+	(lib_name, version_str) tuples. Libraries that are not found are saved
+	too. Returns the number of lookups saved.
+	'''
+	import json
+	import sqlite3
 
-		# Skip this package if the library name is not in the package name
-		if not lib_name.lower() in name.lower():
-			continue
+	rows = []
+	for lookup in lookups:
+		if isinstance(lookup, (tuple, list)):
+			lib_name, version_str = lookup
+		else:
+			lib_name, version_str = lookup, None
+		files = _get_library_files(lib_name, version_str).to_cache()
+		rows.append((lib_name, version_str or '', json.dumps(files['files']), files['version'], json.dumps(files['versions']), files['backend']))
+
+	# Write a new file, and move it over the old one, so readers never see half of it
+	temp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+	if os.path.exists(temp_path):
+		os.remove(temp_path)
+	db = sqlite3.connect(temp_path)
+	try:
+		db.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)')
+		db.execute('CREATE TABLE lookups (lib_name TEXT, version_str TEXT, files TEXT, version TEXT, versions TEXT, backend TEXT, PRIMARY KEY (lib_name, version_str))')
+		db.executemany('INSERT INTO meta VALUES (?, ?)', [
+			('format', str(_manifest_format)),
+			('fingerprint', json.dumps(package_database_fingerprint())),
+			('created', str(time.time())),
+		])
+		db.executemany('INSERT OR REPLACE INTO lookups VALUES (?, ?, ?, ?, ?, ?)', rows)
+		db.commit()
+	finally:
+		db.close()
+	os.rename(temp_path, path)
+	return len(rows)
+
+def load_manifest(path):
+	'''
+	Loads a manifest saved by export_manifest. Lookups in it are answered
+	from it while the package databases of this host have the same
+	fingerprint as the host that saved it. Returns False if the manifest is
+	from a different host, or can not be read.
+	'''
+	global _manifest, _manifest_fingerprint
+	import json
+	import sqlite3
 
-		# Skip this package if the version does not match
-		if version_cb and not version_cb(version):
-			continue
+	try:
+		db = sqlite3.connect(path)
+		try:
+			meta = dict(db.execute('SELECT key, value FROM meta').fetchall())
+			if meta.get('format') != str(_manifest_format):
+				return False
+			fingerprint = tuple([tuple(f) for f in json.loads(meta['fingerprint'])])
+			if fingerprint != package_database_fingerprint():
+				return False
+
+			manifest = {}
+			for lib_name, version_str, files, version, versions, backend in db.execute('SELECT * FROM lookups'):
+				manifest[(version_str or None, lib_name)] = {'files' : json.loads(files), 'version' : version,
+					'versions' : json.loads(versions), 'backend' : backend}
+		finally:
+			db.close()
+	except (sqlite3.Error, KeyError, ValueError) as ex:
+		return False
 
-		# Get all the files and directories
-		result = run_and_get_stdout("rpm -ql {0}".format(package))
-		if not result:
-			continue
+	_manifest = manifest
+	_manifest_fingerprint = fingerprint
+	_library_files_cache.invalidate()
+	return True
 
-		# Save all the files
-		library_entries = result.split("\n")
-		for entry in library_entries:
-			if os.path.isfile(entry):
-				matching_files.append(entry)
+def unload_manifest():
+	global _manifest, _manifest_fingerprint, _manifest_path
+	_manifest = None
+	_manifest_fingerprint = None
+	_manifest_path = None
 
-	return matching_files
+def _get_manifest_files(search_param):
+	global _manifest_path
 
-def _get_library_files_from_pkg_info(lib_name, version_cb = None):
-	lib_name = lib_name.lstrip('lib')
-	matching_files = []
+	if _manifest_path:
+		path, _manifest_path = _manifest_path, None
+		load_manifest(path)
 
-	# Just return if there is not pkg_info
-	if not program_paths('pkg_info'):
-		return matching_files
+	if _manifest is None:
+		return None
+	entry = _manifest.get(search_param)
+	if entry is None:
+		return None
 
-	# Find all packages that contain the name
-	result = run_and_get_stdout("pkg_info | grep -i {0}".format(lib_name))
-	if not result:
-		return matching_files
+	# Stop using the manifest once packages are installed or removed
+	if package_database_fingerprint() != _manifest_fingerprint:
+		unload_manifest()
+		return None
+	return LibraryFiles.from_cache(entry)
 
-	# For each package
-	for package in result.split("\n"):
-		# Get the name and version
-		name = package.split()[0]
-		version = before(name.split('-')[-1], '_')
-		version = version_string_to_tuple(version)
+# FIXME: Make it work with other packaging systems:
+# http://en.wikipedia.org/wiki/List_of_software_package_management_systems
+# Returns the full path of a library file or None
+# If the extension is given, only the file with that extension is needed,
+# so the backends can stop as soon as they find it
+def _get_library_files(lib_name, version_str = None, use_cache = True, extension = None):
+	# Just do the lookup if nobody wants the metrics
+	if not _metrics_collectors:
+		return _find_library_files(lib_name, version_str, use_cache, None, extension)
+
+	metrics = LookupMetrics(lib_name, version_str)
+	_metrics_local.current = metrics
+	try:
+		files = _find_library_files(lib_name, version_str, use_cache, metrics, extension)
+		metrics.files_found = len(files or [])
+		return files
+	finally:
+		metrics.total_time = _timer() - metrics.start_time
+		_metrics_local.current = None
+		_report_metrics(metrics)
+
+def _get_cacher_param(search_param):
+	# Hosts sharing a cache server only share lookups with hosts from the same image
+	if _use_shared_cache:
+		return (host_image_fingerprint(),) + search_param
+	return search_param
+
+def _save_to_cache_server(search_param, files):
+	try:
+		import findlib_server
+		findlib_server.CacheFileChangeDateClient().set_data(_get_cacher_param(search_param), files.to_cache())
+	except Exception as ex:
+		pass
 
-		# Skip this package if the library name is not in the package name
-		if not lib_name.lower() in name.lower():
-			continue
+def _remember_miss(search_param, fingerprint, ttl):
+	if ttl > 0:
+		_library_files_cache.set(search_param, _Miss(fingerprint), min(ttl, _library_files_cache.ttl))
 
-		# Skip this package if the version does not match
-		if version_cb and not version_cb(version):
-			continue
+def _find_library_files(lib_name, version_str, use_cache, metrics, extension):
+	files = LibraryFiles()
 
-		# Get all the files and directories
-		result = run_and_get_stdout("pkg_info -L {0}".format(name))
-		if not result:
-			continue
+	# Create a version_cb from the string
+	version_cb = None
+	if version_str:
+		version_cb = to_version_cb(version_str)
+	search_param = (version_str, lib_name)
 
-		# Save all the files
-		library_entries = result.split("\n")
-		for entry in library_entries:
-			if os.path.isfile(entry):
-				matching_files.append(entry)
+	# Use the files from a recent lookup in this process
+	fingerprint = None
+	if use_cache:
+		is_cached, cached = _library_files_cache.get(search_param)
+		# Or the one file from a lookup that stopped early
+		if not is_cached and extension:
+			is_cached, cached = _library_files_cache.get(search_param + (extension,))
+		# Only use a miss if no packages have changed since
+		if is_cached and isinstance(cached, _Miss):
+			fingerprint = package_database_fingerprint()
+			if cached.fingerprint == fingerprint:
+				cached = LibraryFiles()
+			else:
+				is_cached = False
+		# Carry on with a lookup that stopped early, and save all the files once it is done
+		if is_cached and isinstance(cached, _PartialSearch):
+			files, is_done = cached.search(lib_name, extension)
+			if is_done:
+				_library_files_cache.set(search_param, files.copy())
+				_save_to_cache_server(search_param, files)
+			if metrics:
+				metrics.cache_hit = True
+				metrics.memory_hit = True
+			return files
+		if is_cached:
+			if metrics:
+				metrics.cache_hit = True
+				metrics.memory_hit = True
+			return cached.copy()
+
+	# Use the resolution manifest, if it has this lookup
+	if use_cache:
+		files = _get_manifest_files(search_param)
+		if files is not None:
+			if metrics:
+				metrics.cache_hit = True
+				metrics.memory_hit = True
+			_library_files_cache.set(search_param, files.copy())
+			return files
+
+	# Ask the resolution daemon, if there is one
+	if use_cache and _use_resolution_daemon:
+		start = _timer()
+		try:
+			import findlib_server
+			files = LibraryFiles.from_cache(findlib_server.ResolutionClient().resolve(lib_name, version_str))
+			if metrics:
+				metrics.backends.append(('daemon', start, _timer() - start, bool(files)))
+			if files:
+				_library_files_cache.set(search_param, files.copy())
+			else:
+				fingerprint = fingerprint or package_database_fingerprint()
+				_remember_miss(search_param, fingerprint, _negative_cache_ttl)
+			return files
+		except Exception as ex:
+			pass
 
-	return matching_files
+	# If the query is cached, and none of the resulting files have 
+	# changed, return the cache.
+	cacher = None
+	files = None
+	if use_cache:
+		try:
+			import findlib_server
+			cacher = findlib_server.CacheFileChangeDateClient()
+			cacher_param = _get_cacher_param(search_param)
+			cached = cacher.get_data(cacher_param)
+			cached_param = search_param
+
+			# Or the one file from a lookup that stopped early
+			if cached is None and extension:
+				cached = cacher.get_data(cacher_param + (extension,))
+				cached_param = search_param + (extension,)
+
+			# Use a miss if it has not expired, and no packages have changed since.
+			# Misses from a shared cache are not used, since the library may be
+			# installed on this host without a package, like in /opt.
+			if isinstance(cached, dict) and cached.get('missing') and _use_shared_cache:
+				cached = None
+			elif isinstance(cached, dict) and cached.get('missing'):
+				fingerprint = fingerprint or package_database_fingerprint()
+				if cached['expires'] > time.time() and cached['fingerprint'] == fingerprint:
+					if metrics:
+						metrics.cache_hit = True
+					_remember_miss(search_param, fingerprint, cached['expires'] - time.time())
+					return LibraryFiles()
+				cached = None
+			files = LibraryFiles.from_cache(cached)
+
+			# A shared cache is keyed by the host image instead, since the
+			# server can not see the files on this host. Files installed
+			# without a package can still differ, so make sure they are here.
+			none_have_changed = True
+			if files and _use_shared_cache:
+				if not all([os.path.exists(entry) for entry in files]):
+					files = None
+				else:
+					if metrics:
+						metrics.cache_hit = True
+					_library_files_cache.set(cached_param, files.copy())
+					return files
+			elif files:
+				# Use the modify times saved with the files, so the first
+				# process to reuse them does not see them as changed
+				if isinstance(cached, dict) and 'times' in cached:
+					none_have_changed = not _have_files_changed(files, cached['times'])
+				else:
+					for entry in files:
+						response = cacher.has_file_changed(entry)
+						has_changed = response['has_changed']
+						if has_changed == True:
+							none_have_changed = False
+
+				if none_have_changed:
+					if metrics:
+						metrics.cache_hit = True
+					_library_files_cache.set(cached_param, files.copy())
+					return files
+
+				# Some files changed, so look them up again
+				files = None
+		except Exception as ex:
+			pass
 
-def _get_library_files_from_slackware(lib_name, version_cb = None):
-	matching_files = []
-	lib_name = lib_name.lstrip('lib')
+	# Try finding with each backend that is installed
+	if cacher:
+		_load_backend_stats(cacher)
+	remaining = None
+	if not files:
+		files = LibraryFiles()
+		for backend in _get_ordered_backends():
+			# Skip backends that can not check versions, if there is a version requirement
+			if version_cb and not backend.supports_versions:
+				continue
+			start = _timer()
+			found, remaining = _search_backend(backend, lib_name, version_cb, extension)
+			elapsed = _timer() - start
+			_record_backend_result(backend, elapsed, bool(found))
+			if metrics:
+				metrics.backends.append((backend.name, start, elapsed, bool(found)))
+			if found:
+				found.backend = backend.name
+				files = found
+				break
 
-	# Just return if there is no package info
-	if not os.path.isdir('/var/log/packages'):
-		return matching_files
+	# The search stopped at the file, so keep the rest of it for lookups of
+	# other files. Other processes only get the one file.
+	if remaining is not None:
+		if use_cache:
+			_library_files_cache.set(search_param, _PartialSearch(files, remaining))
+		if cacher:
+			match = files[-1]
+			version = files.get_file_version(match)
+			found = LibraryFiles([match], version, files.backend, {match : version} if version is not None else None)
+			try:
+				cacher.set_data(cacher_param + (extension,), found.to_cache())
+			except Exception as ex:
+				pass
+			_save_backend_stats(cacher)
+		return files.copy()
+
+	# Save the file names in the caches
+	if use_cache and files:
+		_library_files_cache.set(search_param, files.copy())
+	if cacher and files:
+		try:
+			cacher.set_data(cacher_param, files.to_cache())
+		except Exception as ex:
+			pass
 
-	# Get a list of all the installed packages
-	result = run_and_get_stdout("ls /var/log/packages | grep -i {0}".format(lib_name))
-	if not result:
-		return matching_files
+	# Or save that nothing was found, for a shorter time
+	if use_cache and not files and _negative_cache_ttl > 0:
+		fingerprint = fingerprint or package_database_fingerprint()
+		_remember_miss(search_param, fingerprint, _negative_cache_ttl)
+		if cacher and not _use_shared_cache:
+			try:
+				miss = {'missing' : True, 'fingerprint' : fingerprint, 'expires' : time.time() + _negative_cache_ttl}
+				cacher.set_data(cacher_param, miss)
+			except Exception as ex:
+				pass
+
+	# Save the backend stats with the cache
+	if cacher:
+		_save_backend_stats(cacher)
 
-	# For each package
-	for package in result.split("\n"):
-		# Get the metadata for this package
-		result = run_and_get_stdout("cat /var/log/packages/{0}".format(package))
+	return files
 
-		# Get the name (Everything before the version number)
-		name = []
-		for n in package.split('-'):
-			if re.match('^(\d|\.)+$', n):
-				break
-			name.append(n)
-		name = str.join('-', name)
-
-		# Get the version
-		version = None
-		for n in package.split('-'):
-			if re.match('^(\d|\.)+$', n):
-				version = n
-				break
-		version = version_string_to_tuple(version)
+def get_header_file(header_name, version_str = None):
+	library_files = _get_library_files(header_name, version_str, extension='.h')
+	header_file = _get_matched_file_from_library_files(header_name, '.h', library_files)
+	return header_file
 
-		# Skip this package if the version does not match
-		if version_cb and not version_cb(version):
-			continue
+def get_static_library(lib_name, version_str = None):
+	library_files = _get_library_files(lib_name, version_str, extension='.a')
+	static_file = _get_matched_file_from_library_files(lib_name, '.a', library_files)
+	return static_file
 
-		# Skip this package if the library name is not in the package name
-		if not lib_name.lower() in name.lower():
-			continue
+def get_shared_library(lib_name, version_str = None):
+	library_files = _get_library_files(lib_name, version_str, extension=shared_library_extension)
+	shared_file = _get_matched_file_from_library_files(lib_name, shared_library_extension, library_files)
+	return shared_file
 
-		# Get the files
-		for entry in after(result, 'FILE LIST:').split("\n"):
-			entry = '/' + entry
-			if os.path.isfile(entry):
-				matching_files.append(entry)
+class LibraryInfo(object):
+	'''
+	Everything a build needs to know about a library, from one search.
+	headers are all the matching header files, best match first.
+	'''
+	__slots__ = ('name', 'version_str', 'static_library', 'shared_library', 'headers', 'version', 'backend')
+
+	def __init__(self, name, version_str, static_library, shared_library, headers, version, backend):
+		self.name = name
+		self.version_str = version_str
+		self.static_library = static_library
+		self.shared_library = shared_library
+		self.headers = headers
+		self.version = version
+		self.backend = backend
+
+	def get_header(self):
+		if self.headers:
+			return self.headers[0]
+		return None
+	header = property(get_header)
 
-	return matching_files
+	def get_is_found(self):
+		return bool(self.static_library or self.shared_library or self.headers)
+	is_found = property(get_is_found)
 
-def _get_library_files_from_portage(lib_name, version_cb = None):
-	matching_files = []
+	def __repr__(self):
+		return 'LibraryInfo({0!r}, static_library={1!r}, shared_library={2!r}, header={3!r}, version={4!r}, backend={5!r})'.format(
+			self.name, self.static_library, self.shared_library, self.header, self.version, self.backend)
 
-	# Just return if there is not portage
-	if not program_paths('qlist'):
-		return matching_files
+def resolve_library(lib_name, version_str = None):
+	'''
+	Finds the static library, shared library, and headers of a library with
+	one search.
+	'''
+	library_files = _get_library_files(lib_name, version_str)
+	static_library = _get_matched_file_from_library_files(lib_name, '.a', library_files)
+	shared_library = _get_matched_file_from_library_files(lib_name, shared_library_extension, library_files)
+	headers = rank_library_files(lib_name, '.h', library_files)
+
+	# Use the version of the package the library came from, since the files
+	# can be from many packages, like libssl-dev and python3-openssl
+	selected = shared_library or static_library or (headers[0] if headers else None)
+	version = library_files.get_file_version(selected) if selected else library_files.version
+
+	return LibraryInfo(
+		lib_name,
+		version_str,
+		static_library,
+		shared_library,
+		headers,
+		version,
+		library_files.backend
+	)
 
-	# Find all the packages that contain the name
-	result = run_and_get_stdout("qlist -C -I -v | grep -i {0}".format(lib_name))
-	if not result:
-		return matching_files
+# Where each needed library was found, keyed by the needed name, the
+# directories searched, and the ELF class, byte order, and machine
+_needed_library_cache = {}
 
-	# For each package
-	for package in result.split("\n"):
-		# Get the name (Everything before the version number)
-		name = []
-		for n in package.split('-'):
-			if re.match('^(\d|\.)+$', n):
-				break
-			name.append(n)
-		name = str.join('-', name)
-		name = after(name, '/')
-
-		# Get the version
-		version = None
-		for n in package.split('-'):
-			if re.match('^(\d|\.)+$', n):
-				version = n
-				break
-		version = version_string_to_tuple(version)
+def _get_needed_library_search_paths(info):
+	'''
+	Returns the directories the dynamic linker searches for the libraries
+	the ELF file needs, in the same order as ld.so.
+	'''
+	origin = os.path.dirname(os.path.abspath(info.path))
+	paths = []
+	if not info.runpath:
+		paths += info.rpath
+	paths += [p for p in os.environ.get('LD_LIBRARY_PATH', '').split(':') if p]
+	paths += info.runpath
+	return [p.replace('${ORIGIN}', origin).replace('$ORIGIN', origin) for p in paths]
+
+def _find_needed_library(needed, info, library_paths):
+	search_paths = _get_needed_library_search_paths(info)
+	key = (needed, tuple(search_paths), info.elf_class, info.byte_order, info.machine)
+	if key in _needed_library_cache:
+		return _needed_library_cache[key]
+
+	# Look in the directories the dynamic linker would. Skip libraries for
+	# other machines, like 32 bit ones in /usr/lib32.
+	if os.sep in needed:
+		candidates = [needed]
+	else:
+		candidates = [os.path.join(p, needed) for p in search_paths + library_paths]
+	import findlib_elf
+	path = None
+	for candidate in candidates:
+		candidate_info = findlib_elf.read_elf(candidate)
+		if candidate_info and candidate_info.is_compatible(info):
+			path = candidate
+			break
+
+	# Or find it like any other library, such as libcrypto for libcrypto.so.3
+	if not path and not os.sep in needed:
+		lib_name = before(needed, '.so')
+		for entry in _get_library_files(lib_name):
+			if os.path.basename(entry) == needed:
+				candidate_info = findlib_elf.read_elf(entry)
+				if candidate_info and candidate_info.is_compatible(info):
+					path = entry
+					break
+
+	_needed_library_cache[key] = path
+	return path
+
+def shared_library_closure(lib_name, version_str = None):
+	'''
+	Returns the shared library and every shared library it needs, directly
+	or not, as an OrderedDict of the needed names and their paths. The
+	library is first. Libraries that could not be found have a path of None.
+	Returns None if the library is not found.
+	'''
+	path = get_shared_library(lib_name, version_str)
+	if not path:
+		return None
 
-		# Skip this package if the version does not match
-		if version_cb and not version_cb(version):
-			continue
+	import findlib_elf
+	closure = OrderedDict()
+	library_paths = _get_all_library_paths()
+	info = findlib_elf.read_elf(path)
+
+	# Files like libc.so are linker scripts that point to the real library
+	if not info:
+		closure[os.path.basename(path)] = path
+		pending = []
+		for entry in findlib_elf.read_linker_script(path) or []:
+			entry_info = findlib_elf.read_elf(entry)
+			if entry_info:
+				pending.append((os.path.basename(entry), entry, entry_info))
+	else:
+		pending = [(info.soname or os.path.basename(path), path, info)]
 
-		# Skip this package if the library name is not in the package name
-		if not lib_name.lower() in name.lower():
+	# Add the needed libraries breadth first, like the dynamic linker loads them
+	while pending:
+		name, path, info = pending.pop(0)
+		if name in closure:
 			continue
-
-		# Get the files
-		result = run_and_get_stdout("qlist -C {0}".format(name))
-		if not result:
+		closure[name] = path
+		if not info:
 			continue
 
-		for entry in result.split("\n"):
-			if os.path.isfile(entry):
-				matching_files.append(entry)
-
-	return matching_files
-
-def get_header_file(header_name, version_str = None):
-	library_files = _get_library_files(header_name, version_str)
-	header_file = _get_matched_file_from_library_files(header_name, '.h', library_files)
-	return header_file
+		for needed in info.needed:
+			if needed in closure:
+				continue
+			needed_path = _find_needed_library(needed, info, library_paths)
+			needed_info = findlib_elf.read_elf(needed_path) if needed_path else None
+			pending.append((needed, needed_path, needed_info))
 
-def get_static_library(lib_name, version_str = None):
-	library_files = _get_library_files(lib_name, version_str)
-	static_file = _get_matched_file_from_library_files(lib_name, '.a', library_files)
-	return static_file
-
-def get_shared_library(lib_name, version_str = None):
-	extension = None
-	if is_osx:
-		extension = '.dylib'
-	elif is_windows:
-		extension = '.dll'
-	else:
-		extension = '.so'
-
-	library_files = _get_library_files(lib_name, version_str)
-	shared_file = _get_matched_file_from_library_files(lib_name, extension, library_files)
-	return shared_file
+	return closure
 
 def header_path(header_name):
 	retval = None
@@ -992,12 +2263,10 @@ def header_path(header_name):
 		"/usr/include", 
 		"/usr/local/include"
 	]
-	for include_path in include_paths:
-		for root, dirs, files in os.walk(include_path):
-			for file_name in files:
-				complete_name = os.path.join(root, file_name)
-				if complete_name.endswith(header_name):
-					paths.append(complete_name)
+	file_name = os.path.basename(header_name)
+	for complete_name in _walk_files(include_paths, lambda root, entry: entry.endswith(file_name)):
+		if complete_name.endswith(header_name):
+			paths.append(complete_name)
 
 	# Of those paths, get the ones that match the architecture
 	for path in paths:
@@ -1033,6 +2302,7 @@ def include_paths(header_names):
 	return str.join(' ', paths)
 
 def static_or_shared_library_path(lib_name):
+	# Both lookups carry on the same search, which stops at the first one found
 	path = get_static_library(lib_name)
 	if path:
 		return path
@@ -0,0 +1,495 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Copyright (c) 2013-2014, Matthew Brennan Jones <matthew.brennan.jones@gmail.com>
+# Py-findlib is for finding libraries and programs on most operating systems
+# It uses a MIT style license
+# It is hosted at: https://github.com/workhorsy/py-findlib
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# The backends that find the files of installed libraries with each package
+# manager, and on the file system. They are only imported when a lookup
+# first needs them, so importing findlib stays fast.
+
+import os
+import re
+from collections import OrderedDict
+
+import findlib_elf
+
+# The findlib module, set by load_backends before any backend is used
+findlib = None
+
+# The directories pkg-config reads .pc files from, without PKG_CONFIG_PATH
+_pkg_config_paths = None
+
+def _get_pkg_config_paths():
+	global _pkg_config_paths
+	if _pkg_config_paths is None:
+		pc_path = findlib.run_and_get_stdout("pkg-config --variable pc_path pkg-config") or ''
+		_pkg_config_paths = [p for p in pc_path.split(os.pathsep) if p]
+	return [p for p in os.environ.get('PKG_CONFIG_PATH', '').split(os.pathsep) if p] + _pkg_config_paths
+
+def clear_caches():
+	global _pkg_config_paths
+	_pkg_config_paths = None
+
+def _strip_lib_prefix(lib_name):
+	# Only remove a leading "lib", since lstrip('lib') also eats the l, i, and b
+	# at the start of names like bz2, ldap, and blkid
+	return lib_name[3 : ] if lib_name.startswith('lib') else lib_name
+
+def _get_pacman_sync_paths():
+	# pacman -Sl lists the sync databases, which are replaced by pacman -Sy
+	sync_dir = '/var/lib/pacman/sync'
+	try:
+		return [sync_dir] + [os.path.join(sync_dir, f) for f in sorted(os.listdir(sync_dir))]
+	except OSError:
+		return [sync_dir]
+
+def _iter_library_files_from_pkg_config(lib_name, version_cb, library_files):
+	lib_name = _strip_lib_prefix(lib_name)
+
+	# Find all packages that contain the name
+	packages = findlib._get_package_index("pkg-config --list-all", _get_pkg_config_paths()).search(lib_name)
+
+	# For each package
+	for package in packages:
+		# Get the name
+		name = package.split()[0]
+
+		# Skip this package if the library name is not in the package name
+		if not lib_name.lower() in name.lower():
+			continue
+
+		# Get the version, libdir, and includedir
+		version = findlib.run_and_get_stdout("pkg-config --modversion {0}".format(name))
+		libdir = findlib.run_and_get_stdout("pkg-config --variable=libdir {0}".format(name))
+		includedir = findlib.run_and_get_stdout("pkg-config --variable=includedir {0}".format(name))
+		if not version or not libdir or not includedir:
+			continue
+		version = findlib.version_string_to_tuple(version)
+
+		# Skip this package if the version does not match
+		if version_cb and not version_cb(version):
+			continue
+
+		# Save the version of the package the files are from
+		library_files.add_version(version)
+
+		# Get the library files in those directories. Save the file if the
+		# name is in the root, or if the lib name is in the file.
+		lower_name = lib_name.lower()
+		is_match = lambda root, entry: lower_name in root.lower() or 'lib' + lower_name in entry.lower()
+		for f in findlib._walk_files([libdir, includedir], is_match):
+			yield f
+
+def _iter_library_files_from_ports(lib_name, version_cb, library_files):
+	lib_name = _strip_lib_prefix(lib_name)
+
+	# Find all packages that contain the name
+	packages = findlib._get_package_index("port list", ['/opt/local/var/macports/sources']).search(lib_name)
+
+	# For each package
+	for package in packages:
+		# Get the name
+		name = package.split()[0]
+
+		# Skip if the library name is not in the package name
+		if not lib_name.lower() in name.lower():
+			continue
+
+		# Skip if not a devel package
+		if not package.split()[2].startswith('devel/'):
+			continue
+
+		# Get the version
+		version = package.split()[1].lstrip('@')
+		if not version:
+			continue
+		version = findlib.version_string_to_tuple(version)
+
+		# Skip if the version does not match
+		if version_cb and not version_cb(version):
+			continue
+
+		# Get the files and skip if there are none
+		package_files = findlib.run_and_get_stdout("port contents {0}".format(name))
+		if not package_files:
+			continue
+
+		# Save the version of the package the files are from
+		library_files.add_version(version)
+
+		# Get the valid files
+		library_entries = [entry.strip() for entry in package_files.split("\n")]
+		for entry in findlib._iter_existing_files(library_entries):
+			yield entry
+
+# Matches shared library names with a version, like libpcre.so.8.31.0 or
+# libpcre.8.31.0.dylib
+_shared_library_version_re = re.compile(r'^(.+?)(?:\.so\.(\d+(?:\.\d+)*)|\.(\d+(?:\.\d+)*)\.dylib)$')
+
+def _get_install_prefix(path):
+	'''
+	Returns the prefix a file was installed into, like /usr/local for
+	/usr/local/lib/libpcre.so or /usr/local/include/pcre.h.
+	'''
+	parts = path.split(os.sep)
+	for i in range(1, len(parts) - 1):
+		if parts[i] in ('lib', 'lib32', 'lib64', 'include', 'share'):
+			return os.sep.join(parts[0 : i]) or os.sep
+	return os.path.dirname(path)
+
+def _read_pkg_config_version(path):
+	try:
+		with open(path, 'r') as f:
+			for line in f:
+				if line.startswith('Version:'):
+					return line[len('Version:') : ].strip() or None
+	except (IOError, OSError):
+		pass
+	return None
+
+def _get_install_version(lib_name, prefix, files):
+	'''
+	Returns the Version of a library installed into the prefix, or None if
+	it can not be told from the files.
+	'''
+	names = (lib_name.lower(), 'lib' + lib_name.lower())
+
+	# Use the version of the package in its pkg-config file
+	pc_files = [f for f in files if f.endswith('.pc') and os.path.basename(f)[ : -3].lower() in names]
+	for name in names:
+		pc_file = os.path.join(prefix, 'share', 'pkgconfig', name + '.pc')
+		if not pc_file in pc_files and findlib._is_file(pc_file):
+			pc_files.append(pc_file)
+	for pc_file in pc_files:
+		version = _read_pkg_config_version(pc_file)
+		if version:
+			return findlib.parse_version(version)
+
+	# Or the newest version in the shared library names, like libpcre.so.8.31.0
+	versions = []
+	for f in files:
+		match = _shared_library_version_re.match(os.path.basename(f))
+		if match and match.group(1).lower() in names:
+			versions.append(findlib.parse_version(match.group(2) or match.group(3)))
+	if versions:
+		return max(versions)
+
+	# Or the major version in the SONAME, like libpcre.so.3
+	for f in files:
+		if os.path.basename(f).lower() in [n + findlib.shared_library_extension for n in names]:
+			info = findlib_elf.read_elf(f)
+			match = info and info.soname and _shared_library_version_re.match(info.soname)
+			if match:
+				return findlib.parse_version(match.group(2) or match.group(3))
+
+	return None
+
+def _iter_library_files_from_fs(lib_name, version_cb, library_files):
+	lib_name = _strip_lib_prefix(lib_name)
+
+	is_match = lambda root, entry: lib_name in root or lib_name in entry
+	files = findlib._walk_files(findlib._get_all_library_paths(), is_match)
+
+	# Without a version requirement, use the files as they are found
+	if not version_cb:
+		for f in files:
+			yield f
+		return
+
+	# Otherwise group the files by where they were installed, and only use
+	# the installs with a version that matches
+	installs = OrderedDict()
+	for f in files:
+		installs.setdefault(_get_install_prefix(f), []).append(f)
+
+	for prefix, install_files in installs.items():
+		version = _get_install_version(lib_name, prefix, install_files)
+
+		# Skip this install if the version does not match
+		if version is None or not version_cb(version):
+			continue
+
+		# Save the version of the install the files are from
+		library_files.add_version(version)
+
+		for f in install_files:
+			yield f
+
+def _iter_library_files_from_pacman(lib_name, version_cb, library_files):
+	lib_name = _strip_lib_prefix(lib_name)
+
+	# Find all packages that contain the name
+	packages = findlib._get_package_index("pacman -Sl", _get_pacman_sync_paths()).search(lib_name)
+	if not packages:
+		return
+
+	# Get the best package name
+	best_name = findlib._get_best_match([p.split()[1] for p in packages], lib_name)
+	if not best_name:
+		return
+
+	# For each package
+	for package in packages:
+		# Get the name
+		name = package.split()[1]
+
+		# Skip this package if it is not the best name
+		if not best_name == name:
+			continue
+
+		# Skip this package if the library name is not in the package name
+		if not lib_name.lower() in name.lower():
+			continue
+
+		# Get the version
+		version = findlib.version_string_to_tuple(package.split()[2])
+
+		# Skip this package if the version does not match
+		if version_cb and not version_cb(version):
+			continue
+
+		# Get the library files
+		result = findlib.run_and_get_stdout('pacman -Ql {0}'.format(name))
+		if not result:
+			continue
+
+		# Save the version of the package the files are from
+		library_files.add_version(version)
+
+		# Save all the files
+		library_entries = [entry.split()[1] for entry in result.split("\n")]
+		for entry in findlib._iter_existing_files(library_entries):
+			yield entry
+
+def _iter_library_files_from_dpkg(lib_name, version_cb, library_files):
+	# Find all packages that contain the name
+	packages = findlib._get_package_index("dpkg --list", ['/var/lib/dpkg/status']).search(lib_name)
+
+	# For each package
+	for package in packages:
+		# Get the name and version
+		name = findlib.before(package.split()[1], ':')
+		version = findlib.version_string_to_tuple(package.split()[2])
+
+		# Skip this package if the library name is not in the package name
+		if not lib_name.lower() in name.lower():
+			continue
+
+		# Skip this package if the version does not match
+		if version_cb and not version_cb(version):
+			continue
+
+		# Get all the files and directories
+		result = findlib.run_and_get_stdout("dpkg -L {0}".format(name))
+		if not result:
+			continue
+
+		# Save the version of the package the files are from
+		library_files.add_version(version)
+
+		# Save all the files
+		library_entries = result.split("\n")
+		for entry in findlib._iter_existing_files(library_entries):
+			yield entry
+
+def _iter_library_files_from_rpm(lib_name, version_cb, library_files):
+	lib_name = _strip_lib_prefix(lib_name)
+
+	# Find all packages that contain the name
+	packages = findlib._get_package_index("rpm -qa", ['/var/lib/rpm']).search(lib_name)
+
+	# For each package
+	for package in packages:
+		# Get the name and version
+		result = findlib.run_and_get_stdout("rpm -qi {0}".format(package))
+		if not result:
+			continue
+		name = findlib.between(result, 'Name        : ', '\n')
+		version = findlib.between(result, 'Version     : ', '\n')
+		release = findlib.between(result, 'Release     : ', '\n')
+		epoch = findlib.between(result, 'Epoch       : ', '\n')
+		if 'Release     : ' in result:
+			version = '{0}-{1}'.format(version, release)
+		if 'Epoch       : ' in result and epoch.strip().isdigit():
+			version = '{0}:{1}'.format(epoch.strip(), version)
+		version = findlib.version_string_to_tuple(version)
+
+		# Skip this package if the library name is not in the package name
+		if not lib_name.lower() in name.lower():
+			continue
+
+		# Skip this package if the version does not match
+		if version_cb and not version_cb(version):
+			continue
+
+		# Get all the files and directories
+		result = findlib.run_and_get_stdout("rpm -ql {0}".format(package))
+		if not result:
+			continue
+
+		# Save the version of the package the files are from
+		library_files.add_version(version)
+
+		# Save all the files
+		library_entries = result.split("\n")
+		for entry in findlib._iter_existing_files(library_entries):
+			yield entry
+
+def _iter_library_files_from_pkg_info(lib_name, version_cb, library_files):
+	lib_name = _strip_lib_prefix(lib_name)
+
+	# Find all packages that contain the name
+	packages = findlib._get_package_index("pkg_info", ['/var/db/pkg']).search(lib_name)
+
+	# For each package
+	for package in packages:
+		# Get the name and version
+		name = package.split()[0]
+		version = findlib.before(name.split('-')[-1], '_')
+		version = findlib.version_string_to_tuple(version)
+
+		# Skip this package if the library name is not in the package name
+		if not lib_name.lower() in name.lower():
+			continue
+
+		# Skip this package if the version does not match
+		if version_cb and not version_cb(version):
+			continue
+
+		# Get all the files and directories
+		result = findlib.run_and_get_stdout("pkg_info -L {0}".format(name))
+		if not result:
+			continue
+
+		# Save the version of the package the files are from
+		library_files.add_version(version)
+
+		# Save all the files
+		library_entries = result.split("\n")
+		for entry in findlib._iter_existing_files(library_entries):
+			yield entry
+
+def _iter_library_files_from_slackware(lib_name, version_cb, library_files):
+	lib_name = _strip_lib_prefix(lib_name)
+
+	# Get a list of all the installed packages
+	packages = findlib._get_package_index("ls {0}".format(findlib._slackware_packages_dir), [findlib._slackware_packages_dir]).search(lib_name)
+
+	# For each package
+	for package in packages:
+		# Get the metadata for this package
+		result = findlib.run_and_get_stdout("cat {0}/{1}".format(findlib._slackware_packages_dir, package))
+
+		# Get the name (Everything before the version number)
+		name = []
+		for n in package.split('-'):
+			if re.match('^(\d|\.)+$', n):
+				break
+			name.append(n)
+		name = str.join('-', name)
+
+		# Get the version
+		version = None
+		for n in package.split('-'):
+			if re.match('^(\d|\.)+$', n):
+				version = n
+				break
+		version = findlib.version_string_to_tuple(version)
+
+		# Skip this package if the version does not match
+		if version_cb and not version_cb(version):
+			continue
+
+		# Skip this package if the library name is not in the package name
+		if not lib_name.lower() in name.lower():
+			continue
+
+		# Save the version of the package the files are from
+		library_files.add_version(version)
+
+		# Get the files
+		library_entries = ['/' + entry for entry in findlib.after(result, 'FILE LIST:').split("\n")]
+		for entry in findlib._iter_existing_files(library_entries):
+			yield entry
+
+def _iter_library_files_from_portage(lib_name, version_cb, library_files):
+	# Find all the packages that contain the name
+	packages = findlib._get_package_index("qlist -C -I -v", ['/var/db/pkg']).search(lib_name)
+
+	# For each package
+	for package in packages:
+		# Get the name (Everything before the version number)
+		name = []
+		for n in package.split('-'):
+			if re.match('^(\d|\.)+$', n):
+				break
+			name.append(n)
+		name = str.join('-', name)
+		name = findlib.after(name, '/')
+
+		# Get the version
+		version = None
+		for n in package.split('-'):
+			if re.match('^(\d|\.)+$', n):
+				version = n
+				break
+		version = findlib.version_string_to_tuple(version)
+
+		# Skip this package if the version does not match
+		if version_cb and not version_cb(version):
+			continue
+
+		# Skip this package if the library name is not in the package name
+		if not lib_name.lower() in name.lower():
+			continue
+
+		# Get the files
+		result = findlib.run_and_get_stdout("qlist -C {0}".format(name))
+		if not result:
+			continue
+
+		# Save the version of the package the files are from
+		library_files.add_version(version)
+
+		for entry in findlib._iter_existing_files(result.split("\n")):
+			yield entry
+
+def load_backends(module, register_backend):
+	'''
+	Registers each backend with the register_backend function of the
+	findlib module.
+	'''
+	global findlib
+	findlib = module
+
+	register_backend('dpkg', None, lambda: findlib.program_paths('dpkg'), 10, iter_files=_iter_library_files_from_dpkg)
+	register_backend('rpm', None, lambda: findlib.program_paths('rpm'), 20, iter_files=_iter_library_files_from_rpm)
+	register_backend('pacman', None, lambda: findlib.program_paths('pacman'), 30, iter_files=_iter_library_files_from_pacman)
+	register_backend('slackware', None, lambda: os.path.isdir(findlib._slackware_packages_dir), 40, iter_files=_iter_library_files_from_slackware)
+	register_backend('portage', None, lambda: findlib.program_paths('qlist'), 50, iter_files=_iter_library_files_from_portage)
+	register_backend('pkg_info', None, lambda: findlib.program_paths('pkg_info'), 60, iter_files=_iter_library_files_from_pkg_info)
+	register_backend('ports', None, lambda: findlib.program_paths('port'), 70, iter_files=_iter_library_files_from_ports)
+	register_backend('pkg-config', None, lambda: findlib.program_paths('pkg-config'), 80, iter_files=_iter_library_files_from_pkg_config)
+	register_backend('fs', None, None, 90, iter_files=_iter_library_files_from_fs)
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Copyright (c) 2013-2014, Matthew Brennan Jones <matthew.brennan.jones@gmail.com>
+# Py-findlib is for finding libraries and programs on most operating systems
+# It uses a MIT style license
+# It is hosted at: https://github.com/workhorsy/py-findlib
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# Runs shell commands in small helper processes that are started once. Each
+# command in a large build process would otherwise fork all of its memory.
+# A helper only imports what it needs, so forking it is cheap. Run this file
+# to be a helper. It reads commands from stdin and writes the results to
+# stdout, each as a length and a marshalled tuple.
+
+import os, sys
+import marshal
+import struct
+import subprocess
+import threading
+
+_length = struct.Struct('<I')
+
+def _read_exactly(fd, size):
+	chunks = []
+	while size:
+		chunk = os.read(fd, size)
+		if not chunk:
+			return None
+		chunks.append(chunk)
+		size -= len(chunk)
+	return b''.join(chunks)
+
+def _write_all(fd, data):
+	while data:
+		data = data[os.write(fd, data) : ]
+
+def _read_frame(fd):
+	header = _read_exactly(fd, _length.size)
+	if header is None:
+		return None
+	data = _read_exactly(fd, _length.unpack(header)[0])
+	if data is None:
+		return None
+	return marshal.loads(data)
+
+def _write_frame(fd, value):
+	data = marshal.dumps(value)
+	_write_all(fd, _length.pack(len(data)) + data)
+
+def serve(in_fd=0, out_fd=1):
+	'''
+	Runs each command read from in_fd, and writes the return code, stdout,
+	and stderr to out_fd. Returns when in_fd is closed.
+	'''
+	# Commands must not read the requests meant for the helper
+	devnull = open(os.devnull, 'rb')
+	while True:
+		request = _read_frame(in_fd)
+		if request is None:
+			return
+		command, env = request
+		try:
+			process = subprocess.Popen(
+				command,
+				stdin = devnull,
+				stderr = subprocess.PIPE,
+				stdout = subprocess.PIPE,
+				shell = True,
+				env = env
+			)
+			stdout, stderr = process.communicate()
+			result = (process.returncode, stdout, stderr)
+		except OSError as e:
+			result = (127, b'', str(e).encode('UTF-8'))
+		_write_frame(out_fd, result)
+
+class CoprocessError(Exception):
+	pass
+
+class _Coprocess(object):
+	def __init__(self):
+		# Skip site, so the helper starts fast and stays small
+		self._process = subprocess.Popen(
+			[sys.executable, '-S', os.path.abspath(__file__)],
+			stdin = subprocess.PIPE,
+			stdout = subprocess.PIPE,
+			close_fds = True
+		)
+
+	def send(self, command, env):
+		try:
+			_write_frame(self._process.stdin.fileno(), (command, env))
+		except (IOError, OSError) as e:
+			raise CoprocessError(str(e))
+
+	def receive(self):
+		try:
+			result = _read_frame(self._process.stdout.fileno())
+		except (IOError, OSError, ValueError, EOFError) as e:
+			raise CoprocessError(str(e))
+		if result is None:
+			raise CoprocessError('The helper process exited')
+		return result
+
+	def close(self):
+		try:
+			self._process.stdin.close()
+			self._process.stdout.close()
+		except (IOError, OSError):
+			pass
+		self._process.wait()
+
+class CoprocessResult(object):
+	'''
+	A command running in a helper. It has the parts of Popen that
+	ProcessRunner uses: returncode, poll, communicate, and wait.
+	'''
+	def __init__(self, pool, coprocess):
+		self._pool = pool
+		self._coprocess = coprocess
+		self._output = None
+		self.returncode = None
+
+	def _finish(self):
+		if self._coprocess is None:
+			return
+		coprocess, self._coprocess = self._coprocess, None
+		try:
+			self.returncode, stdout, stderr = coprocess.receive()
+		except CoprocessError as e:
+			self._pool._discard(coprocess)
+			self.returncode, stdout, stderr = 127, b'', str(e).encode('UTF-8')
+		else:
+			self._pool._release(coprocess)
+		self._output = (stdout, stderr)
+
+	def poll(self):
+		self._finish()
+		return self.returncode
+
+	def wait(self):
+		self._finish()
+		return self.returncode
+
+	def communicate(self):
+		self._finish()
+		# The output is only returned once, like Popen
+		output, self._output = self._output, (b'', b'')
+		return output
+
+class CoprocessPool(object):
+	'''
+	Up to size helper processes, started when first needed. Each runs one
+	command at a time.
+	'''
+	def __init__(self, size):
+		self.size = size
+		self._idle = []
+		self._started = 0
+		self._condition = threading.Condition()
+
+	def popen(self, command, env):
+		'''
+		Starts the command in a helper and returns a CoprocessResult. Raises
+		CoprocessError if no helper could take it.
+		'''
+		coprocess = self._acquire()
+		try:
+			coprocess.send(command, env)
+		except CoprocessError:
+			self._discard(coprocess)
+			raise
+		return CoprocessResult(self, coprocess)
+
+	def _acquire(self):
+		with self._condition:
+			while not self._idle and self._started >= self.size:
+				self._condition.wait()
+			if self._idle:
+				return self._idle.pop()
+			self._started += 1
+
+		try:
+			return _Coprocess()
+		except (IOError, OSError) as e:
+			with self._condition:
+				self._started -= 1
+				self._condition.notify()
+			raise CoprocessError(str(e))
+
+	def _release(self, coprocess):
+		with self._condition:
+			# Stop the helper if the pool was made smaller or closed
+			if self._started <= self.size:
+				self._idle.append(coprocess)
+				self._condition.notify()
+				return
+		self._discard(coprocess)
+
+	def _discard(self, coprocess):
+		coprocess.close()
+		with self._condition:
+			self._started -= 1
+			self._condition.notify()
+
+	def close(self):
+		'''
+		Stops the idle helpers. Helpers running a command stop when they are
+		given back.
+		'''
+		with self._condition:
+			idle, self._idle = self._idle, []
+			self._started -= len(idle)
+			self.size = 0
+		for coprocess in idle:
+			coprocess.close()
+
+if __name__ == '__main__':
+	serve()
@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Copyright (c) 2013-2014, Matthew Brennan Jones <matthew.brennan.jones@gmail.com>
+# Py-findlib is for finding libraries and programs on most operating systems
+# It uses a MIT style license
+# It is hosted at: https://github.com/workhorsy/py-findlib
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# Reads the dynamic section of ELF shared libraries, without running
+# readelf or ldd. The file is mapped into memory, so only the pages with
+# the headers and strings are read.
+
+import os, sys
+import re
+import mmap
+import struct
+import threading
+
+ELF_MAGIC = b'\x7fELF'
+
+ELFCLASS32 = 1
+ELFCLASS64 = 2
+ELFDATA2LSB = 1
+ELFDATA2MSB = 2
+
+PT_LOAD = 1
+PT_DYNAMIC = 2
+
+DT_NULL = 0
+DT_NEEDED = 1
+DT_STRTAB = 5
+DT_SONAME = 14
+DT_RPATH = 15
+DT_RUNPATH = 29
+
+# The names of the common e_machine values
+MACHINE_NAMES = {
+	2 : 'sparc',
+	3 : 'x86',
+	8 : 'mips',
+	20 : 'ppc',
+	21 : 'ppc64',
+	22 : 's390',
+	40 : 'arm',
+	43 : 'sparcv9',
+	50 : 'ia64',
+	62 : 'x86_64',
+	183 : 'aarch64',
+	243 : 'riscv',
+	258 : 'loongarch',
+}
+
+# The struct formats of the ELF header after e_ident, the program headers,
+# and the dynamic entries, for each class
+_formats = {
+	ELFCLASS32 : ('HHIIIIIHHHHHH', 'IIIIIIII', 'iI'),
+	ELFCLASS64 : ('HHIQQQIHHHHHH', 'IIQQQQQQ', 'qQ'),
+}
+
+class ElfError(Exception):
+	pass
+
+class ElfInfo(object):
+	'''
+	What the dynamic linker needs to know about an ELF file. elf_class is 32
+	or 64. needed, runpath, and rpath are lists of strings in file order.
+	soname is None if the file has none.
+	'''
+	__slots__ = ('path', 'elf_class', 'byte_order', 'machine', 'soname', 'needed', 'runpath', 'rpath')
+
+	def __init__(self, path, elf_class, byte_order, machine, soname, needed, runpath, rpath):
+		self.path = path
+		self.elf_class = elf_class
+		self.byte_order = byte_order
+		self.machine = machine
+		self.soname = soname
+		self.needed = needed
+		self.runpath = runpath
+		self.rpath = rpath
+
+	def get_machine_name(self):
+		return MACHINE_NAMES.get(self.machine, str(self.machine))
+	machine_name = property(get_machine_name)
+
+	def is_compatible(self, other):
+		'''
+		Returns True if the dynamic linker could load both files in one process.
+		'''
+		return (self.elf_class, self.byte_order, self.machine) == (other.elf_class, other.byte_order, other.machine)
+
+	def __repr__(self):
+		return 'ElfInfo({0!r}, {1}-bit {2}, soname={3!r}, needed={4!r})'.format(
+			self.path, self.elf_class, self.machine_name, self.soname, self.needed)
+
+def _decode(data):
+	if sys.version_info[0] == 2:
+		return data
+	return data.decode(sys.getfilesystemencoding(), 'surrogateescape')
+
+def _parse(path, data):
+	if data[0 : 4] != ELF_MAGIC:
+		raise ElfError("Not an ELF file: '{0}'".format(path))
+
+	elf_class = ord(data[4 : 5])
+	byte_order = ord(data[5 : 6])
+	if not elf_class in _formats or not byte_order in (ELFDATA2LSB, ELFDATA2MSB):
+		raise ElfError("Unknown ELF class or byte order: '{0}'".format(path))
+	prefix = '<' if byte_order == ELFDATA2LSB else '>'
+	header_format, program_format, dynamic_format = [prefix + f for f in _formats[elf_class]]
+
+	(e_type, e_machine, e_version, e_entry, e_phoff, e_shoff, e_flags,
+		e_ehsize, e_phentsize, e_phnum, e_shentsize, e_shnum, e_shstrndx) = struct.unpack_from(header_format, data, 16)
+
+	# Find the dynamic section, and the segments that map addresses to file offsets
+	loads = []
+	dynamic = None
+	for i in range(e_phnum):
+		fields = struct.unpack_from(program_format, data, e_phoff + i * e_phentsize)
+		if elf_class == ELFCLASS64:
+			p_type, p_flags, p_offset, p_vaddr, p_paddr, p_filesz, p_memsz, p_align = fields
+		else:
+			p_type, p_offset, p_vaddr, p_paddr, p_filesz, p_memsz, p_flags, p_align = fields
+		if p_type == PT_LOAD:
+			loads.append((p_vaddr, p_offset, p_filesz))
+		elif p_type == PT_DYNAMIC:
+			dynamic = (p_offset, p_filesz)
+
+	# Static executables and object files have no dynamic section
+	if dynamic is None:
+		return ElfInfo(path, 32 if elf_class == ELFCLASS32 else 64, byte_order, e_machine, None, [], [], [])
+
+	# Read the dynamic entries, but not the strings they point to yet
+	entries = []
+	strtab = None
+	entry_size = struct.calcsize(dynamic_format)
+	offset, size = dynamic
+	for i in range(size // entry_size):
+		tag, value = struct.unpack_from(dynamic_format, data, offset + i * entry_size)
+		if tag == DT_NULL:
+			break
+		elif tag == DT_STRTAB:
+			strtab = value
+		elif tag in (DT_NEEDED, DT_SONAME, DT_RPATH, DT_RUNPATH):
+			entries.append((tag, value))
+
+	# The string table is given as an address, so find where it is in the file
+	strtab_offset = None
+	for vaddr, file_offset, file_size in loads:
+		if strtab is not None and vaddr <= strtab < vaddr + file_size:
+			strtab_offset = strtab - vaddr + file_offset
+			break
+	if entries and strtab_offset is None:
+		raise ElfError("ELF string table not found: '{0}'".format(path))
+
+	soname = None
+	needed, runpath, rpath = [], [], []
+	for tag, value in entries:
+		start = strtab_offset + value
+		end = data.find(b'\0', start)
+		if end == -1:
+			raise ElfError("ELF string not terminated: '{0}'".format(path))
+		string = _decode(data[start : end])
+
+		if tag == DT_NEEDED:
+			needed.append(string)
+		elif tag == DT_SONAME:
+			soname = string
+		elif tag == DT_RUNPATH:
+			runpath += [p for p in string.split(':') if p]
+		elif tag == DT_RPATH:
+			rpath += [p for p in string.split(':') if p]
+
+	return ElfInfo(path, 32 if elf_class == ELFCLASS32 else 64, byte_order, e_machine, soname, needed, runpath, rpath)
+
+# The ElfInfo of each file read, keyed by path, with its mtime and size
+_elf_cache = {}
+_elf_cache_lock = threading.Lock()
+
+def read_elf(path):
+	'''
+	Returns the ElfInfo of the file, or None if it is not an ELF file. The
+	result is remembered until the file changes.
+	'''
+	try:
+		st = os.stat(path)
+	except OSError:
+		return None
+	key = (st.st_mtime, st.st_size)
+
+	with _elf_cache_lock:
+		cached = _elf_cache.get(path)
+	if cached and cached[0] == key:
+		return cached[1]
+
+	info = None
+	if st.st_size >= 64:
+		try:
+			with open(path, 'rb') as f:
+				data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+				try:
+					info = _parse(path, data)
+				finally:
+					data.close()
+		except (IOError, OSError, ValueError, struct.error, ElfError):
+			info = None
+
+	with _elf_cache_lock:
+		_elf_cache[path] = (key, info)
+	return info
+
+def clear_elf_cache():
+	with _elf_cache_lock:
+		_elf_cache.clear()
+
+_linker_script_group_re = re.compile(r'\b(?:GROUP|INPUT)\s*\(([^)]*(?:\([^)]*\)[^)]*)*)\)')
+
+def read_linker_script(path):
+	'''
+	Returns the files a linker script like /usr/lib/libc.so pulls in with
+	GROUP or INPUT, or None if the file is not a linker script.
+	'''
+	try:
+		with open(path, 'rb') as f:
+			data = f.read(4096)
+	except (IOError, OSError):
+		return None
+	if data[0 : 4] == ELF_MAGIC or b'\0' in data:
+		return None
+
+	files = []
+	for group in _linker_script_group_re.findall(_decode(data)):
+		for entry in group.replace('(', ' ').replace(')', ' ').replace(',', ' ').split():
+			if entry != 'AS_NEEDED':
+				files.append(entry)
+	return files or None
@@ -26,69 +26,483 @@
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 import os, sys
+import re
 import socket
-import pickle
+import struct
 import logging
+import tempfile
+import threading
+import time
+
+CACHE_PORT = 9000
+RESOLUTION_PORT = 9001
+
+# Use the most precise clock available for timing
+_timer = getattr(time, 'perf_counter', time.time)
+
+# Addresses are a (host, port) tuple for TCP, or a string for a Unix domain
+# socket. Strings that start with a null byte are in the Linux abstract
+# namespace, and have no file. The default is a socket file in a directory
+# private to the user.
+has_unix_sockets = hasattr(socket, 'AF_UNIX')
+
+def _get_private_socket_dir():
+	'''
+	Returns a directory only this user can use, for the default sockets.
+	Abstract sockets have no permissions, so any local user could listen on
+	one first and answer this user's lookups.
+	'''
+	runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+	if runtime_dir and os.path.isdir(runtime_dir):
+		return runtime_dir
+
+	user = os.getuid() if hasattr(os, 'getuid') else 0
+	path = os.path.join(tempfile.gettempdir(), 'findlib-{0}'.format(user))
+	try:
+		os.mkdir(path, 0o700)
+	except OSError:
+		pass
+
+	# Make sure another user did not make the directory first
+	info = os.lstat(path)
+	if not os.path.isdir(path) or os.path.islink(path) or info.st_uid != user or info.st_mode & 0o077:
+		raise Exception('The socket directory "{0}" is not private to this user'.format(path))
+	return path
+
+def _default_unix_address(name):
+	return os.path.join(_get_private_socket_dir(), 'findlib-{0}.sock'.format(name))
+
+def parse_address(text):
+	'''
+	Parses an address like "localhost:9000", "/tmp/findlib.sock", or
+	"@findlib" for the Linux abstract namespace.
+	'''
+	if text.startswith('@'):
+		return '\0' + text[1 : ]
+	if os.sep in text or not ':' in text:
+		return text
+	# Without a host, only listen on this host. Use 0.0.0.0 to listen on all.
+	host, port = text.rsplit(':', 1)
+	return (host or 'localhost', int(port))
+
+def format_address(address):
+	if isinstance(address, tuple):
+		return '{0}:{1}'.format(address[0], address[1])
+	if address.startswith('\0'):
+		return '@' + address[1 : ]
+	return address
+
+def _default_address(env_name, name, port):
+	# Use the address from the environment, then a local socket, then TCP
+	if os.environ.get(env_name):
+		return parse_address(os.environ[env_name])
+	if has_unix_sockets:
+		return _default_unix_address(name)
+	return ('localhost', port)
+
+def get_cache_address():
+	return _default_address('FINDLIB_CACHE_ADDRESS', 'cache', CACHE_PORT)
+
+def get_resolution_address():
+	return _default_address('FINDLIB_DAEMON_ADDRESS', 'resolve', RESOLUTION_PORT)
+
+def connect(address):
+	if isinstance(address, tuple):
+		sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	else:
+		sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+	try:
+		sock.connect(address)
+	except:
+		sock.close()
+		raise
+	return sock
+
+def is_server_running(address):
+	try:
+		connect(address).close()
+		return True
+	except socket.error:
+		return False
+
+PY2 = sys.version_info[0] == 2
+_text_type = unicode if PY2 else str
+
+# Messages are a 4 byte length, then the encoded value. Each value is a one
+# byte tag, then its data. Lengths and counts are unsigned 32 bit integers.
+_header = struct.Struct('!I')
+
+# The largest message that will be read. The length comes from the peer, so
+# a bad length must not make us allocate gigabytes.
+MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+_int = struct.Struct('!q')
+_float = struct.Struct('!d')
+_TAG_NONE = b'N'
+_TAG_TRUE = b'T'
+_TAG_FALSE = b'F'
+_TAG_INT = b'i'
+_TAG_FLOAT = b'd'
+_TAG_STRING = b's'
+_TAG_BYTES = b'y'
+_TAG_LIST = b'l'
+_TAG_TUPLE = b't'
+_TAG_DICT = b'm'
+# A list of strings, joined by null bytes, which can not be in file names
+_TAG_STRING_LIST = b'S'
+# File names that are not UTF-8 are kept as surrogates by os.listdir, so
+# send them back as the bytes they came from
+_string_errors = 'strict' if PY2 else 'surrogateescape'
+
+def _encode_value(value, parts):
+	if value is None:
+		parts.append(_TAG_NONE)
+	elif value is True:
+		parts.append(_TAG_TRUE)
+	elif value is False:
+		parts.append(_TAG_FALSE)
+	elif isinstance(value, _text_type) or (PY2 and isinstance(value, str)):
+		if not PY2 or isinstance(value, unicode):
+			value = value.encode('utf-8', _string_errors)
+		parts.append(_TAG_STRING)
+		parts.append(_header.pack(len(value)))
+		parts.append(value)
+	elif isinstance(value, bytes):
+		parts.append(_TAG_BYTES)
+		parts.append(_header.pack(len(value)))
+		parts.append(value)
+	elif isinstance(value, int) or (PY2 and isinstance(value, long)):
+		parts.append(_TAG_INT)
+		parts.append(_int.pack(value))
+	elif isinstance(value, float):
+		parts.append(_TAG_FLOAT)
+		parts.append(_float.pack(value))
+	elif isinstance(value, list):
+		# Send lists of file names as one block
+		if value and all(isinstance(v, _text_type) for v in value):
+			blob = '\0'.join(value).encode('utf-8', _string_errors)
+			if blob.count(b'\0') == len(value) - 1:
+				parts.append(_TAG_STRING_LIST)
+				parts.append(_header.pack(len(value)))
+				parts.append(_header.pack(len(blob)))
+				parts.append(blob)
+				return
+
+		parts.append(_TAG_LIST)
+		parts.append(_header.pack(len(value)))
+		for v in value:
+			_encode_value(v, parts)
+	elif isinstance(value, tuple):
+		parts.append(_TAG_TUPLE)
+		parts.append(_header.pack(len(value)))
+		for v in value:
+			_encode_value(v, parts)
+	elif isinstance(value, dict):
+		parts.append(_TAG_DICT)
+		parts.append(_header.pack(len(value)))
+		for k, v in value.items():
+			_encode_value(k, parts)
+			_encode_value(v, parts)
+	else:
+		raise TypeError('Can not encode {0} in a message'.format(type(value)))
+
+def encode_message(value):
+	'''
+	Returns the message bytes, including the length header.
+	'''
+	parts = []
+	_encode_value(value, parts)
+	body = b''.join(parts)
+	return _header.pack(len(body)) + body
+
+def _decode_value(view, offset):
+	tag = view[offset : offset + 1].tobytes()
+	offset += 1
+
+	if tag == _TAG_NONE:
+		return None, offset
+	elif tag == _TAG_TRUE:
+		return True, offset
+	elif tag == _TAG_FALSE:
+		return False, offset
+	elif tag == _TAG_STRING or tag == _TAG_BYTES:
+		length = _header.unpack_from(view, offset)[0]
+		offset += _header.size
+		value = view[offset : offset + length].tobytes()
+		if tag == _TAG_STRING:
+			value = value.decode('utf-8', _string_errors)
+		return value, offset + length
+	elif tag == _TAG_INT:
+		return _int.unpack_from(view, offset)[0], offset + _int.size
+	elif tag == _TAG_FLOAT:
+		return _float.unpack_from(view, offset)[0], offset + _float.size
+	elif tag == _TAG_STRING_LIST:
+		count, length = struct.unpack_from('!II', view, offset)
+		offset += 8
+		blob = view[offset : offset + length].tobytes().decode('utf-8', _string_errors)
+		return blob.split('\0') if count else [], offset + length
+	elif tag == _TAG_LIST or tag == _TAG_TUPLE:
+		count = _header.unpack_from(view, offset)[0]
+		offset += _header.size
+		items = []
+		for i in range(count):
+			item, offset = _decode_value(view, offset)
+			items.append(item)
+		if tag == _TAG_TUPLE:
+			items = tuple(items)
+		return items, offset
+	elif tag == _TAG_DICT:
+		count = _header.unpack_from(view, offset)[0]
+		offset += _header.size
+		items = {}
+		for i in range(count):
+			key, offset = _decode_value(view, offset)
+			items[key], offset = _decode_value(view, offset)
+		return items, offset
+	else:
+		raise ValueError('Unknown message tag: {0!r}'.format(tag))
+
+def decode_message(data):
+	'''
+	Decodes a message body, without the length header. The data can be
+	bytes, a bytearray, or a memoryview.
+	'''
+	view = memoryview(data)
+	value, offset = _decode_value(view, 0)
+	if offset != len(view):
+		raise ValueError('Message has {0} extra bytes'.format(len(view) - offset))
+	return value
+
+def send_message(sock, value):
+	sock.sendall(encode_message(value))
+
+def _recv_into(sock, view):
+	# Fill the view, or return False if the socket closed first
+	got = 0
+	while got < len(view):
+		size = sock.recv_into(view[got : ])
+		if not size:
+			return False
+		got += size
+	return True
+
+def recv_message(sock, buffer=None):
+	'''
+	Reads the next message into the buffer. Returns the message and the
+	buffer, which is replaced with a bigger one if the message did not fit.
+	The message is None if the socket was closed.
+	'''
+	if buffer is None:
+		buffer = bytearray(65536)
+
+	# Read the length
+	view = memoryview(buffer)
+	if not _recv_into(sock, view[0 : _header.size]):
+		return None, buffer
+	length = _header.unpack_from(buffer, 0)[0]
+	if length > MAX_MESSAGE_SIZE:
+		raise socket.error('Message of {0} bytes is bigger than the {1} byte limit'.format(length, MAX_MESSAGE_SIZE))
+
+	# Make the buffer bigger if needed, then read the message into it
+	if length > len(buffer):
+		buffer = bytearray(min(max(length, len(buffer) * 2), MAX_MESSAGE_SIZE))
+		view = memoryview(buffer)
+	if not _recv_into(sock, view[0 : length]):
+		raise socket.error('Socket closed in the middle of a message')
+
+	return decode_message(view[0 : length]), buffer
+
+# Latency histograms have a bucket for each power of two microseconds
+_histogram_buckets = 32
+
+def _histogram_percentile(histogram, percent):
+	# Returns the upper bound in microseconds of the bucket with the percentile
+	total = sum(histogram)
+	if not total:
+		return 0
+	seen = 0
+	for i, count in enumerate(histogram):
+		seen += count
+		if seen * 100.0 >= total * percent:
+			return 1 << i
+	return 1 << (len(histogram) - 1)
+
+def _estimate_size(value):
+	'''
+	Returns about how many bytes of memory the value and everything in it use.
+	'''
+	size = sys.getsizeof(value)
+	if isinstance(value, dict):
+		for key, item in value.items():
+			size += _estimate_size(key) + _estimate_size(item)
+	elif isinstance(value, (list, tuple)):
+		for item in value:
+			size += _estimate_size(item)
+	return size
+
+# The requests the servers know. Stats are only kept for these, so clients
+# can not make them grow by sending made up requests.
+_request_types = frozenset(['cache_file', 'set_data', 'add_data', 'get_data', 'resolve', 'stats'])
+
+class ServerStats(object):
+	'''
+	Counts the requests a server handles by type, the lookups that were hits
+	or misses, and how long each request took. Latencies are kept in
+	histograms with a bucket for each power of two microseconds.
+	'''
+	def __init__(self):
+		self.start_time = time.time()
+		self.requests = {}
+		self.latencies = {}
+		self.hits = 0
+		self.misses = 0
+		self._lock = threading.Lock()
+
+	def record(self, request, seconds):
+		# Requests come from clients, so count unknown ones together
+		if not isinstance(request, (str, _text_type)) or request not in _request_types:
+			request = 'unknown'
+		bucket = min(int(seconds * 1000000).bit_length(), _histogram_buckets - 1)
+		with self._lock:
+			self.requests[request] = self.requests.get(request, 0) + 1
+			histogram = self.latencies.get(request)
+			if histogram is None:
+				histogram = [0] * _histogram_buckets
+				self.latencies[request] = histogram
+			histogram[bucket] += 1
+
+	def record_lookup(self, is_hit):
+		with self._lock:
+			if is_hit:
+				self.hits += 1
+			else:
+				self.misses += 1
+
+	def to_dict(self):
+		with self._lock:
+			lookups = self.hits + self.misses
+			return {
+				'uptime' : time.time() - self.start_time,
+				'requests' : dict(self.requests),
+				'hits' : self.hits,
+				'misses' : self.misses,
+				'hit_rate' : float(self.hits) / lookups if lookups else 0.0,
+				# Each bucket is [upper bound in microseconds, count]
+				'latency_us' : dict([(request, [[1 << i, count] for i, count in enumerate(histogram) if count])
+					for request, histogram in self.latencies.items()]),
+			}
+
+	def summary(self):
+		with self._lock:
+			lookups = self.hits + self.misses
+			parts = []
+			for request in sorted(self.requests.keys()):
+				histogram = self.latencies[request]
+				parts.append('{0} {1} (p50 <{2}us, p99 <{3}us)'.format(request, self.requests[request],
+					_histogram_percentile(histogram, 50), _histogram_percentile(histogram, 99)))
+			return '{0} requests: {1}; hit rate {2:.1f}% of {3} lookups'.format(
+				sum(self.requests.values()), ', '.join(parts) or 'none',
+				100.0 * self.hits / lookups if lookups else 0.0, lookups)
 
 class Server(object):
-	def __init__(self, hostname, port):
+	# Handle each client in its own thread, instead of one at a time
+	threaded = False
+	# Seconds between the stats summaries in the log, or 0 for none
+	stats_interval = 60.0
+
+	def __init__(self, address, port=None):
 		self.logger = logging.getLogger('server')
-		self.hostname = hostname
-		self.port = port
+		# Still take the old hostname and port arguments
+		if port is not None:
+			address = (address, port)
+		self.address = address
+		self.stats = ServerStats()
+		self.socket = None
+		# The socket file this server made, so close only removes its own
+		self._socket_path = None
+
+	def get_stats(self):
+		'''
+		Returns the stats that are sent for a stats request. Servers with
+		entries add their counts and memory use.
+		'''
+		return self.stats.to_dict()
+
+	def _log_stats(self):
+		while True:
+			time.sleep(self.stats_interval)
+			self.logger.info(self.stats.summary())
 
 	def start(self):
 		self.logger.debug('listening')
-		self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-		self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-		self.socket.bind((self.hostname, self.port))
-		self.socket.listen(1)
+		if isinstance(self.address, tuple):
+			self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+			self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		else:
+			self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+			# Remove the socket file left by an old server
+			if not self.address.startswith('\0') and os.path.exists(self.address):
+				if is_server_running(self.address):
+					raise Exception('A server is already running at {0}'.format(self.address))
+				os.remove(self.address)
+		self.socket.bind(self.address)
+		if not isinstance(self.address, tuple) and not self.address.startswith('\0'):
+			self._socket_path = self.address
+		self.socket.listen(64 if self.threaded else 1)
+
+		if self.stats_interval > 0:
+			thread = threading.Thread(target=self._log_stats)
+			thread.daemon = True
+			thread.start()
 
 		while True:
 			conn, address = self.socket.accept()
-			self.logger.debug('Got connection')
-			self.fire_on_client_connect(conn, address)
+			if self.threaded:
+				thread = threading.Thread(target=self.fire_on_client_connect, args=(conn, address))
+				thread.daemon = True
+				thread.start()
+			else:
+				self.fire_on_client_connect(conn, address)
+
+	def close(self):
+		if self.socket:
+			self.socket.close()
+		# Remove the socket file, if this server made it
+		if self._socket_path and os.path.exists(self._socket_path):
+			os.remove(self._socket_path)
+		self._socket_path = None
 
 	def fire_on_client_connect(self, conn, address):
-		logging.basicConfig(level=logging.DEBUG)
-		logger = logging.getLogger("process-{0}".format(address))
+		# Nothing is logged for each request, since that would slow down every request
 		try:
-			logger.debug("Connected %r at %r", conn, address)
-			raw_message = b''
+			buffer = bytearray(65536)
 			while True:
-				# Read the next chunk
-				chunk = conn.recv(1024)
+				# Read the next message
+				message, buffer = recv_message(conn, buffer)
 
-				# The chunk is blank, so there is no more message
-				if chunk == b'':
-					logger.debug('Socket closed remotely')
+				# There is no message, so the socket was closed
+				if message is None:
 					break
 
-				# Add the chunk to the message
-				raw_message += chunk
-
-				# The chunk is max size, there may be more message to read
-				if len(chunk) == 1024:
-					continue
-
-				# Unpickle the message
-				message = pickle.loads(raw_message)
-				logger.debug("Received message %r", message)
-
-				# Fire the client connect event
-				self.on_client_connect(conn, message)
-				logger.debug('Sent message')
+				# Fire the client connect event, or send the stats
+				start = _timer()
+				request = message.get('request')
+				if request == 'stats':
+					send_message(conn, {'status':'ok', 'stats':self.get_stats()})
+				else:
+					self.on_client_connect(conn, message)
+				self.stats.record(request, _timer() - start)
 		except:
-			logger.exception('Problem handling request')
+			self.logger.exception('Problem handling request')
 		finally:
-			logger.debug('Closing socket')
 			conn.close()
 
 	def on_client_connect(self, conn, message):
 		raise NotImplementedError('The on_client_connect method should be overridden in a child class.')
 
 class CacheFileChangeDateServer(Server):
-	def __init__(self, hostname, port):
-		super(CacheFileChangeDateServer, self).__init__(hostname, port)
+	def __init__(self, address, port=None):
+		super(CacheFileChangeDateServer, self).__init__(address, port)
 		self.cached_times = {}
 		self.cached_data = {}
 
@@ -96,28 +510,48 @@ class CacheFileChangeDateServer(Server):
 		# cache file request
 		if message['request'] == 'cache_file':
 			has_changed = self._has_file_changed(message['file'])
-			conn.sendall(pickle.dumps({'status':'ok', 'has_changed':has_changed, 'file':message['file']}))
+			send_message(conn, {'status':'ok', 'has_changed':has_changed, 'file':message['file']})
 		# set data request
 		elif message['request'] == 'set_data':
 			key = message['key']
 			value = message['value']
 			self.cached_data[key] = value
-			conn.sendall(pickle.dumps({'status':'ok', 'key':key}))
+			send_message(conn, {'status':'ok', 'key':key})
+		# add data request, that adds the numbers in a dict of tuples to the saved ones
+		elif message['request'] == 'add_data':
+			key = message['key']
+			saved = self.cached_data.get(key)
+			if not isinstance(saved, dict):
+				saved = {}
+			for name, numbers in message['value'].items():
+				old = saved.get(name)
+				if old and len(old) == len(numbers):
+					numbers = [a + b for a, b in zip(old, numbers)]
+				saved[name] = tuple(numbers)
+			self.cached_data[key] = saved
+			send_message(conn, {'status':'ok', 'key':key})
 		# get data request
 		elif message['request'] == 'get_data':
 			key = message['key']
 			value = None
 			if key in self.cached_data:
 				value = self.cached_data[key]
-			conn.sendall(pickle.dumps({'status':'ok', 'key':key, 'value':value}))
+			self.stats.record_lookup(value is not None)
+			send_message(conn, {'status':'ok', 'key':key, 'value':value})
 		# Unknown request
 		else:
-			conn.sendall(pickle.dumps({'status':'fail', 'message':'Unknown request: {0}'.format(message['request'])}))
+			send_message(conn, {'status':'fail', 'message':'Unknown request: {0}'.format(message['request'])})
+
+	def get_stats(self):
+		stats = super(CacheFileChangeDateServer, self).get_stats()
+		stats['entries'] = len(self.cached_data)
+		stats['file_times'] = len(self.cached_times)
+		stats['memory_bytes'] = _estimate_size(dict(self.cached_data)) + _estimate_size(dict(self.cached_times))
+		return stats
 
 	def _has_file_changed(self, name):
 		# Return true if the file does not exist
 		if not os.path.isfile(os.path.abspath(name)):
-			print("not a file: '{0}'".format(name))
 			return None
 
 		# Get the modify time from the cache
@@ -128,7 +562,6 @@ class CacheFileChangeDateServer(Server):
 		# Get the modify time from the file system
 		fs_time = os.path.getmtime(name)
 
-		print("fs_time:{0}, cached_time:{1}".format(fs_time, cached_time))
 		# Return true if the file system has a newer date than the cache
 		if fs_time > cached_time:
 			self.cached_times[name] = fs_time
@@ -136,17 +569,256 @@ class CacheFileChangeDateServer(Server):
 
 		return False
 
+class _PendingResolution(object):
+	def __init__(self):
+		self.event = threading.Event()
+		self.files = None
+		self.error = None
+
+# Requests come from other processes, so only take library names that are
+# safe in shell commands, and version strings that are short and simple
+_safe_lib_name_re = re.compile(r'^[A-Za-z0-9_.+-]+$')
+_max_version_str = 256
+
+def _is_safe_version_str(version_str):
+	'''
+	Returns True if the version string only compares ver to numbers,
+	strings, and tuples of them, like "ver >= (8, 31) and ver < (9,)". The
+	parts ver.major, ver.minor, ver.micro, ver[0], and ver[:2] can be used
+	too. Other code, like "ver >= (9**9**9,)", could hang the server when
+	evaluated.
+	'''
+	import ast
+	if len(version_str) > _max_version_str:
+		return False
+	try:
+		tree = ast.parse(version_str, mode='eval')
+	except SyntaxError:
+		return False
+
+	literals = tuple([getattr(ast, name) for name in ('Constant', 'Num', 'Str') if hasattr(ast, name)])
+	operators = (ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.And, ast.Or, ast.Not, ast.USub, ast.Load)
+	# Before Python 3.9, subscripts wrap the index in an Index node
+	indexes = (ast.Slice, ast.Index) if hasattr(ast, 'Index') else (ast.Slice,)
+	for node in ast.walk(tree):
+		if isinstance(node, ast.Name):
+			if node.id != 'ver':
+				return False
+		elif isinstance(node, ast.Attribute):
+			if not _is_ver(node.value) or node.attr not in ('major', 'minor', 'micro'):
+				return False
+		elif isinstance(node, ast.Subscript):
+			if not _is_ver(node.value) or not _is_int_index(node.slice, literals):
+				return False
+		elif isinstance(node, literals):
+			value = getattr(node, 'value', getattr(node, 'n', getattr(node, 's', None)))
+			if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+				return False
+		elif not isinstance(node, (ast.Expression, ast.Compare, ast.BoolOp, ast.UnaryOp, ast.Tuple) + indexes + operators):
+			return False
+	return True
+
+def _is_ver(node):
+	import ast
+	return isinstance(node, ast.Name) and node.id == 'ver'
+
+def _is_int_index(node, literals):
+	# An int like 0 or -1, or a slice of them like 1:3
+	import ast
+	if hasattr(ast, 'Index') and isinstance(node, ast.Index):
+		node = node.value
+	if isinstance(node, ast.Slice):
+		return all([part is None or _is_int_index(part, literals) for part in (node.lower, node.upper, node.step)])
+	if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+		node = node.operand
+	value = getattr(node, 'value', getattr(node, 'n', None)) if isinstance(node, literals) else None
+	return isinstance(value, int) and not isinstance(value, bool)
+
+class ResolutionServer(Server):
+	'''
+	Finds library files for clients, instead of them each doing the work.
+	Results are kept in memory until the package databases change, then the
+	known queries are resolved again in the background to keep them warm.
+	Identical requests that arrive while one is being resolved wait for
+	that one, instead of running the backends again.
+	'''
+	threaded = True
+
+	def __init__(self, address, port=None, check_interval=1.0):
+		super(ResolutionServer, self).__init__(address, port)
+		self.check_interval = check_interval
+		self.resolved = {}
+		self._in_flight = {}
+		self._lock = threading.Lock()
+		self._fingerprint = None
+		self._last_check = 0
+		self.refused = 0
+
+		# Import here, because findlib also imports this module
+		import findlib
+		self.findlib = findlib
+
+	def on_client_connect(self, conn, message):
+		# resolve request
+		if message['request'] == 'resolve':
+			try:
+				lib_name, version_str = message['lib_name'], message.get('version_str')
+				if not isinstance(lib_name, (str, _text_type)) or not _safe_lib_name_re.match(lib_name):
+					self._refuse('Invalid library name: {0!r}'.format(lib_name))
+				if version_str is not None and (not isinstance(version_str, (str, _text_type)) or not _is_safe_version_str(version_str)):
+					self._refuse('Invalid version string: {0!r}'.format(version_str))
+				files = self.resolve(lib_name, version_str)
+				reply = files.to_cache()
+				reply['status'] = 'ok'
+			except Exception as e:
+				reply = {'status':'fail', 'message':str(e)}
+		# Unknown request
+		else:
+			reply = {'status':'fail', 'message':'Unknown request: {0}'.format(message['request'])}
+
+		send_message(conn, reply)
+
+	def _refuse(self, message):
+		# Log and count refused requests, so clients that are turned away can be found
+		with self._lock:
+			self.refused += 1
+		self.logger.warning('Refused request: {0}'.format(message))
+		raise Exception(message)
+
+	def resolve(self, lib_name, version_str=None):
+		self._check_package_databases()
+		key = (version_str, lib_name)
+
+		# Use the result if it is known, or wait for the same request if it is running
+		with self._lock:
+			if key in self.resolved:
+				self.stats.record_lookup(True)
+				return self.resolved[key]
+			pending = self._in_flight.get(key)
+			is_owner = pending is None
+			if is_owner:
+				pending = _PendingResolution()
+				self._in_flight[key] = pending
+		self.stats.record_lookup(not is_owner)
+
+		if not is_owner:
+			pending.event.wait()
+			if pending.error:
+				raise pending.error
+			return pending.files
+
+		try:
+			fingerprint = self._fingerprint
+			pending.files = self.findlib._get_library_files(lib_name, version_str, use_cache=False)
+			# Only keep the result if the packages did not change while resolving
+			with self._lock:
+				if self._fingerprint == fingerprint:
+					self.resolved[key] = pending.files
+			return pending.files
+		except Exception as e:
+			pending.error = e
+			raise
+		finally:
+			with self._lock:
+				del self._in_flight[key]
+			pending.event.set()
+
+	def get_stats(self):
+		stats = super(ResolutionServer, self).get_stats()
+		with self._lock:
+			stats['entries'] = len(self.resolved)
+			stats['in_flight'] = len(self._in_flight)
+			stats['refused'] = self.refused
+			stats['memory_bytes'] = _estimate_size(dict(self.resolved))
+		return stats
+
+	def _check_package_databases(self):
+		# Only check the databases once per interval
+		now = time.time()
+		if now - self._last_check < self.check_interval:
+			return
+		self._last_check = now
+
+		fingerprint = self.findlib.package_database_fingerprint()
+		if fingerprint == self._fingerprint:
+			return
+		is_first_check = self._fingerprint is None
+		if is_first_check:
+			self._fingerprint = fingerprint
+			return
+
+		# The packages changed, so forget everything and resolve the known queries again
+		self.logger.info('Package databases changed')
+		with self._lock:
+			self._fingerprint = fingerprint
+			keys = list(self.resolved.keys())
+			self.resolved = {}
+		self.findlib.clear_caches()
+
+		thread = threading.Thread(target=self._warm, args=(keys,))
+		thread.daemon = True
+		thread.start()
+
+	def _warm(self, keys):
+		for version_str, lib_name in keys:
+			try:
+				self.resolve(lib_name, version_str)
+			except Exception as e:
+				self.logger.exception('Problem resolving {0}'.format(lib_name))
+
+def get_stats(address):
+	'''
+	Returns the stats of the cache server or resolution daemon at the address.
+	'''
+	sock = connect(address)
+	try:
+		send_message(sock, {'request':'stats'})
+		result, buffer = recv_message(sock)
+	finally:
+		sock.close()
+
+	if result is None:
+		raise socket.error('Server closed the connection')
+	return result['stats']
+
+class ResolutionClient(object):
+	'''
+	Asks the resolution daemon for a library. resolve returns a dict with the
+	files, the version of their package, and the backend that found them.
+	'''
+	def __init__(self, address=None):
+		self.address = address or get_resolution_address()
+
+	def resolve(self, lib_name, version_str=None):
+		sock = connect(self.address)
+		try:
+			# Send the query, and get the files
+			message = {'request':'resolve', 'lib_name':lib_name, 'version_str':version_str}
+			send_message(sock, message)
+			result, buffer = recv_message(sock)
+		finally:
+			sock.close()
+
+		if result is None:
+			raise socket.error('Server closed the connection')
+		if result['status'] != 'ok':
+			raise Exception(result['message'])
+		return result
+
 class CacheFileChangeDateClient(object):
+	def __init__(self, address=None):
+		self.address = address or get_cache_address()
+		self._buffer = None
+
 	def has_file_changed(self, file_name):
 		self._connect()
 
 		# Send a request to cache a file change date
 		data = {'request':'cache_file', 'file':file_name}
-		data = pickle.dumps(data)
-		self.sock.sendall(data)
+		send_message(self.sock, data)
 
 		# Get the response that says if it has changed or not since the last check
-		result = pickle.loads(self.sock.recv(1024))
+		result = self._recv()
 
 		self._disconnect()
 
@@ -157,11 +829,26 @@ class CacheFileChangeDateClient(object):
 
 		# 
 		data = {'request':'set_data', 'key':key, 'value':value}
-		data = pickle.dumps(data)
-		self.sock.sendall(data)
+		send_message(self.sock, data)
 
 		# 
-		result = pickle.loads(self.sock.recv(10240))
+		result = self._recv()
+
+		self._disconnect()
+
+		return result
+
+	def add_data(self, key, value):
+		'''
+		Adds the numbers in a dict of tuples to the ones saved under the key.
+		Many clients can add to the same key without losing any changes.
+		'''
+		self._connect()
+
+		data = {'request':'add_data', 'key':key, 'value':value}
+		send_message(self.sock, data)
+
+		result = self._recv()
 
 		self._disconnect()
 
@@ -172,11 +859,10 @@ class CacheFileChangeDateClient(object):
 
 		# 
 		message = {'request':'get_data', 'key':key}
-		message = pickle.dumps(message)
-		self.sock.sendall(message)
+		send_message(self.sock, message)
 
 		# 
-		result = pickle.loads(self.sock.recv(10240))
+		result = self._recv()
 
 		self._disconnect()
 
@@ -184,23 +870,57 @@ class CacheFileChangeDateClient(object):
 
 	def _connect(self):
 		# Connect to the server
-		self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-		self.sock.connect(('localhost', 9000))
+		self.sock = connect(self.address)
+
+	def _recv(self):
+		result, self._buffer = recv_message(self.sock, self._buffer)
+		if result is None:
+			raise socket.error('Server closed the connection')
+		return result
 
 	def _disconnect(self):
 		# Disconnect from the server
 		self.sock.close()
 
 if __name__ == '__main__':
-	logging.basicConfig(level=logging.DEBUG)
-	server = CacheFileChangeDateServer('0.0.0.0', 9000)
+	import argparse
+	parser = argparse.ArgumentParser(description='Runs the findlib cache server.')
+	parser.add_argument('--resolve', action='store_true', help='Run the resolution daemon, that finds libraries for clients')
+	parser.add_argument('--address', default=None,
+		help='Listen on host:port for TCP, a socket file path, or @name for an abstract socket. Defaults to a local socket.')
+	parser.add_argument('--stats', action='store_true', help='Print the stats of the server that is running, and exit')
+	parser.add_argument('--stats-interval', type=float, default=Server.stats_interval,
+		help='Seconds between stats summaries in the log, or 0 for none')
+	parser.add_argument('--verbose', action='store_true', help='Log debug messages')
+	args = parser.parse_args()
+
+	# Get the address to listen on
+	if args.address:
+		address = parse_address(args.address)
+	elif args.resolve:
+		address = get_resolution_address()
+	else:
+		address = get_cache_address()
+
+	if args.stats:
+		import json
+		print(json.dumps(get_stats(address), indent=4, sort_keys=True))
+		sys.exit(0)
+
+	logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+	if args.resolve:
+		server = ResolutionServer(address)
+	else:
+		server = CacheFileChangeDateServer(address)
+	server.stats_interval = args.stats_interval
 	try:
-		logging.info('Listening')
+		logging.info('Listening on {0}'.format(format_address(address)))
 		server.start()
 	except:
 		logging.exception('Unexpected exception')
 	finally:
 		logging.info('Shutting down')
+		server.close()
 	logging.info('All done')
 
 